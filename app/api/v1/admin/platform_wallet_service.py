@@ -36,8 +36,8 @@ async def admin_get_platform_wallet_history(
     service: PlatformWalletService = Depends(),
 ):
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
 
     return await service.get_platform_wallet_history_admin_async(
         page=page,
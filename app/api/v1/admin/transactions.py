@@ -33,8 +33,8 @@ async def admin_get_transactions(
     Admin lấy danh sách giao dịch đầy đủ (lọc + tìm kiếm + phân trang).
     """
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     return await service.get_transactions_admin_async(
         page=page,
         limit=limit,
@@ -125,8 +125,8 @@ async def get_instructor_holding_earnings(
 ):
     await auth.require_role(["ADMIN"])
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     return await service.get_instructor_pending_earnings(
         instructor_id=None,
         page=page,
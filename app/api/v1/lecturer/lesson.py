@@ -400,10 +400,11 @@ async def get_lesson_video(
 
 @router.get("/ok/{video_id}/test", status_code=status.HTTP_200_OK)
 async def test(
+    background_tasks: BackgroundTasks,
     video_id: str = "dQw4w9WgXcQ",
     lesson_service: LessonService = Depends(LessonService),
 ):
     try:
-        return await lesson_service.test(video_id)
+        return await lesson_service.test(video_id, background_tasks)
     except Exception as e:
         raise e
@@ -30,8 +30,8 @@ async def list_refund_requests(
 ):
     reviewer = await auth.require_role(["LECTURER"])
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     return await service.get_all_refund_status_async(
         reviewer_id=reviewer.id,
         role="LECTURER",
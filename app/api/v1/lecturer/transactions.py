@@ -33,8 +33,8 @@ async def lecturer_get_transactions(
     - discount_history + discount_info
     """
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     instructor = await authorization_service.require_role(["LECTURER"])
     # ============================
     return await transactions_service.get_lecturer_transactions(
@@ -66,8 +66,8 @@ async def get_instructor_holding_earnings(
 ):
     user = await auth.require_role(["LECTURER"])
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     return await service.get_instructor_pending_earnings(
         instructor_id=user.id,
         page=page,
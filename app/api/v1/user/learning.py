@@ -4,7 +4,6 @@ from typing import Optional
 
 from fastapi import (
     APIRouter,
-    BackgroundTasks,
     Depends,
     Query,
     WebSocket,
@@ -205,14 +204,13 @@ async def get_lesson_start_code(
 @router.post("/lesson_note/{lesson_id}/create")
 async def create_lesson_note(
     lesson_id: uuid.UUID,
-    background_tasks: BackgroundTasks,
     schema: CreateLessonNote,
     learning_service: LearningService = Depends(LearningService),
     authorization: AuthorizationService = Depends(AuthorizationService),
 ):
     user = await authorization.get_current_user()
     return await learning_service.create_lesson_note_async(
-        lesson_id, schema, user.id, background_tasks
+        lesson_id, schema, user.id
     )
 
 
@@ -57,8 +57,8 @@ async def get_my_refund_requests(
     authorization: AuthorizationService = Depends(AuthorizationService),
 ):
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     user = await authorization.get_current_user()
     return await service.get_user_refund_courses(
         user_id=user.id,
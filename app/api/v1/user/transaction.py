@@ -29,8 +29,8 @@ async def get_my_transactions(
     transactions_service: TransactionsService = Depends(TransactionsService),
 ):
     # chuẩn hóa datetime (UTC+7 naive)
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     user = await authorization_service.get_current_user()
     return await transactions_service.get_user_transactions(
         user_id=user.id,
@@ -62,8 +62,8 @@ async def get_my_transactions_top_5(
     authorization_service: AuthorizationService = Depends(AuthorizationService),
     transactions_service: TransactionsService = Depends(TransactionsService),
 ):
-    date_from = await to_vietnam_naive(date_from)
-    date_to = await to_vietnam_naive(date_to)
+    date_from = to_vietnam_naive(date_from)
+    date_to = to_vietnam_naive(date_to)
     user = await authorization_service.get_current_user()
     return await transactions_service.get_user_transactions(
         user_id=user.id,
@@ -52,7 +52,7 @@ class AuthorizationService:
             if not user:
                 raise HTTPException(status_code=401, detail="Invalid token")
 
-            user.last_login_at = await to_utc_naive(get_now())
+            user.last_login_at = to_utc_naive(get_now())
             await self.db.commit()
             await self.db.refresh(user)
             return user
@@ -82,7 +82,7 @@ class AuthorizationService:
             if not user:
                 return None
 
-            user.last_login_at = await to_utc_naive(get_now())
+            user.last_login_at = to_utc_naive(get_now())
             await self.db.commit()
             await self.db.refresh(user)
             return user
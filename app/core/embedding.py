@@ -1,7 +1,9 @@
 # app/core/embedding.py
 import asyncio
+import hashlib
 import mimetypes
 import uuid
+from collections import OrderedDict
 from email.quoprimime import unquote
 from math import exp
 from urllib.parse import unquote
@@ -24,6 +26,8 @@ from app.libs.formats.datetime import now as get_now
 
 class EmbeddingService:
     BASE_URL = "https://generativelanguage.googleapis.com/v1beta/models"
+    # Cache LRU vector theo SHA-256 nội dung (float32 bytes, ~6KB / vector)
+    EMBED_CACHE_MAX = 4096
 
     def __init__(self):
         genai.configure(api_key=settings.GOOGLE_API_KEY)
@@ -32,11 +36,38 @@ class EmbeddingService:
         self.EMBED_MODEL = "models/gemini-embedding-001"
         self.EMBED_DIM = 1536
         self.API_KEY = settings.GOOGLE_API_KEY
+        self._embed_cache: OrderedDict[str, bytes] = OrderedDict()
+
+    # ========== EMBEDDING CACHE ==========
+    def _embed_cache_key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.EMBED_MODEL}:{self.EMBED_DIM}:{digest}"
+
+    def _embed_cache_get(self, text: str) -> list[float] | None:
+        key = self._embed_cache_key(text)
+        raw = self._embed_cache.get(key)
+        if raw is None:
+            return None
+        self._embed_cache.move_to_end(key)
+        return np.frombuffer(raw, dtype="<f4").tolist()
+
+    def _embed_cache_put(self, text: str, vector: list[float]) -> None:
+        # Không cache vector 0 (đầu vào rỗng hoặc API lỗi)
+        if not any(vector):
+            return
+        self._embed_cache[self._embed_cache_key(text)] = np.asarray(
+            vector, dtype="<f4"
+        ).tobytes()
+        if len(self._embed_cache) > self.EMBED_CACHE_MAX:
+            self._embed_cache.popitem(last=False)
 
     async def embed_google_normalized(self, text: str) -> list[float]:
         """Sinh embedding Google Gemini, ép chiều và chuẩn hóa vector."""
         if not text or not text.strip():
             return [0.0] * self.EMBED_DIM
+        cached = self._embed_cache_get(text.strip())
+        if cached is not None:
+            return cached
 
         def _sync_embed():
             try:
@@ -60,7 +91,69 @@ class EmbeddingService:
                 print(f"❌ Lỗi khi embedding: {e}")
                 return [0.0] * self.EMBED_DIM
 
-        return await asyncio.to_thread(_sync_embed)
+        vector = await asyncio.to_thread(_sync_embed)
+        self._embed_cache_put(text.strip(), vector)
+        return vector
+
+    # Gemini batchEmbedContents nhận tối đa 100 input / request
+    EMBED_BATCH_SIZE = 100
+
+    async def embed_google_normalized_batch(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embedding nhiều đoạn văn bản, mỗi lô EMBED_BATCH_SIZE đoạn = 1 API call.
+        Kết quả giữ đúng thứ tự `texts`; đoạn rỗng → vector 0 như embed_google_normalized.
+        """
+        results: list[list[float]] = [[0.0] * self.EMBED_DIM for _ in texts]
+        todo: list[tuple[int, str]] = []
+        for i, t in enumerate(texts):
+            if not t or not t.strip():
+                continue
+            cached = self._embed_cache_get(t.strip())
+            if cached is not None:
+                results[i] = cached
+            else:
+                todo.append((i, t.strip()))
+        if not todo:
+            return results
+
+        def _sync_embed_batch(batch: list[str]) -> np.ndarray:
+            resp = genai.embed_content(
+                model=self.EMBED_MODEL,
+                content=batch,
+                task_type="retrieval_document",
+                output_dimensionality=self.EMBED_DIM,
+            )
+            vectors = np.asarray(resp["embedding"], dtype=np.float32)
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            # Chuẩn hóa L2 để DB lưu đồng nhất
+            return vectors / norms
+
+        groups = [
+            todo[i : i + self.EMBED_BATCH_SIZE]
+            for i in range(0, len(todo), self.EMBED_BATCH_SIZE)
+        ]
+        for group, outcome in zip(
+            groups,
+            await asyncio.gather(
+                *(
+                    asyncio.to_thread(_sync_embed_batch, [t for _, t in group])
+                    for group in groups
+                ),
+                return_exceptions=True,
+            ),
+        ):
+            if isinstance(outcome, BaseException):
+                logger.warning(f"⚠️ Batch embedding lỗi, thử từng đoạn: {outcome}")
+                vectors = await asyncio.gather(
+                    *(self.embed_google_normalized(t) for _, t in group)
+                )
+            else:
+                vectors = outcome.tolist()
+            for (i, t), vec in zip(group, vectors):
+                results[i] = vec
+                self._embed_cache_put(t, vec)
+        return results
 
     # ========== GEMINI 2.5 FLASH ==========
     async def extract_video_context_from_url(self, url_sharelink: str) -> str:
@@ -158,30 +251,39 @@ class EmbeddingService:
         - chunk_size: số token tối đa cho mỗi chunk
         - overlap: số token trùng lặp giữa hai chunk liên tiếp
         """
-        import tiktoken
+        return self.split_text_with_token_counts(text, chunk_size, overlap)[0]
 
+    def split_text_with_token_counts(
+        self,
+        text: str,
+        chunk_size: int = 1000,
+        overlap: int = 100,
+    ) -> tuple[list[str], list[int], int]:
+        """
+        Như split_text_by_tokens nhưng trả thêm số token của từng chunk và của cả văn bản,
+        lấy luôn từ lần encode duy nhất (không tokenize lại từng chunk).
+        """
         # 1️⃣ Chuẩn hóa giá trị overlap (phòng lỗi)
         if overlap >= chunk_size:
             overlap = max(0, chunk_size // 5)  # overlap không thể lớn hơn chunk_size
 
-        enc = tiktoken.get_encoding("cl100k_base")
-        tokens = enc.encode(text)
+        tokens = self._enc.encode(text)
         total_tokens = len(tokens)
 
-        chunks = []
+        chunks: list[str] = []
+        token_counts: list[int] = []
         step = chunk_size - overlap
 
         # 2️⃣ Chia theo bước, đảm bảo không dư token cuối
         for i in range(0, total_tokens, step):
             end = min(i + chunk_size, total_tokens)
-            chunk_tokens = tokens[i:end]
-            chunk_text = enc.decode(chunk_tokens)
-            chunks.append(chunk_text)
+            chunks.append(self._enc.decode(tokens[i:end]))
+            token_counts.append(end - i)
 
             if end >= total_tokens:
                 break
 
-        return chunks
+        return chunks, token_counts, total_tokens
 
     from typing import List
 
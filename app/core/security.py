@@ -1,4 +1,7 @@
+import asyncio
+import os
 import secrets
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from typing import Any, Dict
 
@@ -8,6 +11,18 @@ import jwt
 from app.core.settings import settings
 from app.libs.formats.datetime import now_tzinfo
 
+# Pool riêng cho bcrypt, giới hạn theo số core → credential stuffing không làm nghẽn cả worker
+_bcrypt_pool: ThreadPoolExecutor | None = None
+
+
+def _get_bcrypt_pool() -> ThreadPoolExecutor:
+    global _bcrypt_pool
+    if _bcrypt_pool is None:
+        _bcrypt_pool = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 2, thread_name_prefix="bcrypt"
+        )
+    return _bcrypt_pool
+
 
 class SecurityService:
     def __init__(self):
@@ -40,14 +55,24 @@ class SecurityService:
             raise ValueError("Invalid token")
 
     # 🔑 PASSWORD
+    # bcrypt tốn ~100-300ms CPU → chạy trong pool riêng (bcrypt nhả GIL khi băm),
+    # không chặn event loop và không chiếm default executor của to_thread
     @staticmethod
     async def hash_password(plain: str) -> str:
-        return bcrypt.hashpw(plain.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        hashed = await asyncio.get_running_loop().run_in_executor(
+            _get_bcrypt_pool(), bcrypt.hashpw, plain.encode("utf-8"), bcrypt.gensalt()
+        )
+        return hashed.decode("utf-8")
 
     @staticmethod
     async def verify_password(plain: str, hashed: str) -> bool:
         try:
-            return bcrypt.checkpw(plain.encode("utf-8"), hashed.encode("utf-8"))
+            return await asyncio.get_running_loop().run_in_executor(
+                _get_bcrypt_pool(),
+                bcrypt.checkpw,
+                plain.encode("utf-8"),
+                hashed.encode("utf-8"),
+            )
         except Exception:
             return False
 
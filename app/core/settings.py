@@ -43,6 +43,15 @@ class Settings(BaseSettings):
 
     PISTON_URL: str = ""
 
+    # OCR: "auto" (dùng CUDA nếu có) | "cuda" | "cpu"
+    EASYOCR_DEVICE: str = "auto"
+    # Chỉ khi chạy CUDA: compile detector/recognizer bằng torch-tensorrt (FP16)
+    EASYOCR_TENSORRT: bool = False
+    # Chỉ khi chạy CPU: chạy detector/recognizer qua OpenVINO (cần cài `openvino`)
+    EASYOCR_OPENVINO: bool = False
+    # Nạp EasyOCR ngay khi import app (gunicorn --preload) để các worker fork dùng chung model
+    EASYOCR_PRELOAD: bool = False
+
     # PayPal
     PAYPAL_CLIENT_ID: str = ""
     PAYPAL_CLIENT_SECRET: str = ""
@@ -77,6 +77,7 @@ class SupportedLanguages(Base):
     __tablename__ = 'supported_languages'
     __table_args__ = (
         PrimaryKeyConstraint('id', name='supported_languages_pkey'),
+        UniqueConstraint('name', 'version', name='uq_supported_lang_name_ver'),
         {'schema': 'public'}
     )
 
@@ -205,6 +206,7 @@ class EmailVerifications(Base):
     __table_args__ = (
     ForeignKeyConstraint(['user_id'], ['public.user.id'], name='email_verifications_user_fk'),
         PrimaryKeyConstraint('id', name='email_verifications_pk'),
+        Index('idx_email_verifications_user_created', 'user_id', text('created_at DESC')),
         {'schema': 'public'}
     )
 
@@ -898,6 +900,7 @@ class LessonNotes(Base):
     content: Mapped[str] = mapped_column(Text, nullable=False)
     embedding: Mapped[Optional[Any]] = mapped_column(VECTOR(1536))
     created_at: Mapped[Optional[datetime.datetime]] = mapped_column(DateTime(True), server_default=text('now()'))
+    content_hash: Mapped[Optional[str]] = mapped_column(Text)
 
     lesson: Mapped['Lessons'] = relationship('Lessons', back_populates='lesson_notes')
     user: Mapped['User'] = relationship('User', back_populates='lesson_notes')
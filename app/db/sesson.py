@@ -1,7 +1,8 @@
 # app/database.py
 import os
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator, Dict, List, Type
 
+from sqlalchemy import insert
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
 from app.core.settings import settings
@@ -34,3 +35,37 @@ async def get_session() -> AsyncGenerator[AsyncSession, None]:
             yield session
         finally:
             await session.close()
+
+
+# ✅ Bulk insert: ít dòng → INSERT executemany, nhiều dòng → COPY (asyncpg)
+COPY_THRESHOLD = 100
+
+
+async def bulk_insert_rows(
+    session: AsyncSession, model: Type[Any], rows: List[Dict[str, Any]]
+) -> None:
+    """
+    Ghi nhiều dòng cho `model` trong transaction hiện tại của session.
+    - rows là list dict theo tên attribute ORM (vd: `text_`), cùng bộ key.
+    - Từ COPY_THRESHOLD dòng trở lên dùng asyncpg `copy_records_to_table`.
+    """
+    if not rows:
+        return
+    if len(rows) < COPY_THRESHOLD:
+        await session.execute(insert(model), rows)
+        return
+
+    table = model.__table__
+    keys = list(rows[0].keys())
+    # Map tên attribute ORM → tên cột thật trong DB
+    columns = [model.__mapper__.attrs[k].columns[0].name for k in keys]
+    records = [tuple(row[k] for k in keys) for row in rows]
+
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        table.name,
+        records=records,
+        columns=columns,
+        schema_name=table.schema or "public",
+    )
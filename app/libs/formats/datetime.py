@@ -16,7 +16,7 @@ def now_tzinfo() -> datetime:
     return datetime.now(VIETNAM_TIMEZONE)
 
 
-async def to_vietnam_naive(dt: datetime | None) -> datetime | None:
+def to_vietnam_naive(dt: datetime | None) -> datetime | None:
     """Chuyển datetime (có hoặc không tzinfo) sang múi giờ Việt Nam (UTC+7) và bỏ tzinfo.
     - Nếu dt là None → trả về None
     - Nếu dt có timezone → convert sang UTC+7, bỏ tzinfo
@@ -34,11 +34,11 @@ async def to_vietnam_naive(dt: datetime | None) -> datetime | None:
 
 
 # Giữ lại để backward compatibility, nhưng sẽ redirect sang hàm mới
-async def to_utc_naive(dt: datetime | None) -> datetime | None:
+def to_utc_naive(dt: datetime | None) -> datetime | None:
     """DEPRECATED: Sử dụng to_vietnam_naive() thay thế.
     Chuyển datetime (có hoặc không tzinfo) sang múi giờ Việt Nam (UTC+7) và bỏ tzinfo.
     """
-    return await to_vietnam_naive(dt)
+    return to_vietnam_naive(dt)
 
 
 async def serialize(obj: Any) -> Any:
@@ -1,10 +1,13 @@
+import sys
 from contextlib import asynccontextmanager
 
 import httpx
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi_pagination import add_pagination
+from loguru import logger
 
 # --- ADMIN ROUTES ---
 from app.api.v1 import test
@@ -45,16 +48,35 @@ from app.api.v1.user import refunds as user_refunds
 from app.api.v1.user import transaction as user_transaction
 from app.api.v1.user import tutor_chat as user_tutor_chat
 from app.core.scheduler import scheduler, start_scheduler
+from app.core.settings import settings
+from app.services.shares.code_runner import close_piston_service
+from app.services.shares.currency_service import close_currency_client
+from app.services.shares.google_driver import close_google_drive_service
+from app.services.shares.note_embedding import (
+    start_note_embedding_workers,
+    stop_note_embedding_workers,
+)
+from app.services.shares.OCR_service import close_ocr_http_client, preload_ocr_service
 
 # --- MIDDLEWARE ---
 from app.middleware.request_context import RequestContextMiddleware
 
 # --- USER ROUTES ---
 
+# Nạp OCR lúc import (trước khi gunicorn --preload fork worker) để chia sẻ model copy-on-write
+if settings.EASYOCR_PRELOAD:
+    preload_ocr_service()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
 
+    # ================================
+    # 0) LOGGING (ghi log qua queue + thread riêng, không block event loop)
+    # ================================
+    logger.remove()
+    logger.add(sys.stderr, enqueue=True, backtrace=False)
+
     # ================================
     # 1) GLOBAL HTTP CLIENT
     # ================================
@@ -68,6 +90,11 @@ async def lifespan(app: FastAPI):
     start_scheduler(http)
     print("⏱ Scheduler started")
 
+    # ================================
+    # 3) NOTE EMBEDDING WORKERS (asyncio.Queue)
+    # ================================
+    start_note_embedding_workers()
+
     # App chạy
     try:
         yield
@@ -87,6 +114,18 @@ async def lifespan(app: FastAPI):
         except Exception as e:
             print("⚠ Scheduler shutdown error:", e)
 
+        # ================================
+        # 5) CLOSE SHARED SERVICE CLIENTS (Drive, Piston, tỷ giá) + NOTE WORKERS
+        # ================================
+        await close_google_drive_service()
+        await close_piston_service()
+        await close_currency_client()
+        close_ocr_http_client()
+        await stop_note_embedding_workers()
+
+        # Đẩy hết log còn trong queue trước khi tắt
+        await logger.complete()
+
 
 # ===== APP CONFIG =====
 app = FastAPI(
@@ -94,6 +133,8 @@ app = FastAPI(
     description="Backend demo với cấu hình trong main.py",
     version="0.1.0",
     lifespan=lifespan,
+    # orjson encode UTF-8 (message tiếng Việt) nhanh hơn json chuẩn nhiều lần
+    default_response_class=ORJSONResponse,
     swagger_ui_parameters={"withCredentials": True},  # 🔑 Cho phép Swagger gửi cookie
 )
 
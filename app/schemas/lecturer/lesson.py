@@ -35,6 +35,7 @@ class UpdateLessonResourcesLinkSchema(BaseModel):
 
 
 class LessonQuizOptionCreate(BaseModel):
+    id: Optional[uuid.UUID] = None  # có id → cập nhật option cũ (khi update)
     text: str
     is_correct: bool = False
     feedback: Optional[str] = None
@@ -42,6 +43,7 @@ class LessonQuizOptionCreate(BaseModel):
 
 
 class LessonQuizItemCreate(BaseModel):
+    id: Optional[uuid.UUID] = None  # có id → cập nhật quiz cũ (khi update)
     question: str
     explanation: Optional[str] = None
     difficulty_level: Optional[int] = 1
@@ -246,9 +246,9 @@ class LecturerService:
                     detail="Không thể xóa tài khoản của chính mình",
                 )
 
-            user.deleted_at = await to_utc_naive(get_now())
+            user.deleted_at = to_utc_naive(get_now())
             user.deleted_until = reason or "Không có lý do cụ thể"
-            user.update_at = await to_utc_naive(get_now())
+            user.update_at = to_utc_naive(get_now())
 
             await self.db.commit()
             await self.db.refresh(user)
@@ -504,8 +504,8 @@ class LecturerService:
             if schema.is_block_permanently:
                 lecturer.banned_until = None
             else:
-                lecturer.banned_until = await to_utc_naive(schema.banned_until or get_now())
-            lecturer.update_at = await to_utc_naive(get_now())
+                lecturer.banned_until = to_utc_naive(schema.banned_until or get_now())
+            lecturer.update_at = to_utc_naive(get_now())
 
             await self.db.commit()
             await self.db.refresh(lecturer)
@@ -681,8 +681,8 @@ class LecturerService:
                 insert(UserRoles).values(
                     user_id=user_id,
                     role_id=lecturer_role.id,
-                    create_at=await to_utc_naive(get_now()),
-                    update_at=await to_utc_naive(get_now()),
+                    create_at=to_utc_naive(get_now()),
+                    update_at=to_utc_naive(get_now()),
                 )
             )
             await self.db.commit()
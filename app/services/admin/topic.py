@@ -44,8 +44,8 @@ class TopicService:
             **schema.dict(),
             order_index=new_order,
             slug=slug,
-            created_at=await to_utc_naive(get_now()),
-            updated_at=await to_utc_naive(get_now()),
+            created_at=to_utc_naive(get_now()),
+            updated_at=to_utc_naive(get_now()),
         )
 
         self.db.add(new_topic)
@@ -68,7 +68,7 @@ class TopicService:
                     .where(Topics.id == topic_id)
                     .values(
                         embedding=vector,
-                        updated_at=await to_utc_naive(get_now()),
+                        updated_at=to_utc_naive(get_now()),
                     )
                 )
                 await db.commit()
@@ -224,7 +224,7 @@ class TopicService:
         if schema.is_active is not None:
             topic.is_active = schema.is_active
 
-        topic.updated_at = await to_utc_naive(get_now())
+        topic.updated_at = to_utc_naive(get_now())
 
         # 4️⃣ Lưu thay đổi
         await self.db.commit()
@@ -264,7 +264,7 @@ class TopicService:
                     .where(Topics.id == topic_id)
                     .values(
                         embedding=vector,
-                        updated_at=await to_utc_naive(get_now()),
+                        updated_at=to_utc_naive(get_now()),
                     )
                 )
                 await db.commit()
@@ -357,10 +357,10 @@ class UserService:
             if schema.is_block_permanently:
                 user.banned_until = None
             else:
-                user.banned_until = await to_utc_naive(
+                user.banned_until = to_utc_naive(
                     schema.banned_until or get_now()
                 )
-            user.update_at = await to_utc_naive(get_now())
+            user.update_at = to_utc_naive(get_now())
 
             await self.db.commit()
             await self.db.refresh(user)
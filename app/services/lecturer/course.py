@@ -101,8 +101,8 @@ class CourseService:
                 **schema.model_dump(exclude={"thumbnail_file"}),
                 instructor_id=lecturer.id,
                 slug=slug,
-                created_at=await to_utc_naive(get_now()),
-                updated_at=await to_utc_naive(get_now()),
+                created_at=to_utc_naive(get_now()),
+                updated_at=to_utc_naive(get_now()),
             )
 
             # 6️⃣ Lưu DB ngay để có course_id
@@ -164,8 +164,8 @@ class CourseService:
 
                 course.embedding = vector
                 course.search_tsv = func.to_tsvector("simple", text_search)
-                course.embedding_updated_at = await to_utc_naive(get_now())
-                course.updated_at = await to_utc_naive(get_now())
+                course.embedding_updated_at = to_utc_naive(get_now())
+                course.updated_at = to_utc_naive(get_now())
 
                 await db.commit()
                 print(f"✅ [{course_id}] Embedding và full-text đã hoàn tất")
@@ -477,7 +477,7 @@ class CourseService:
 
         # 6️⃣ Cập nhật thông tin
         update_data = schema.model_dump(exclude_unset=True)
-        update_data["updated_at"] = await to_utc_naive(get_now())
+        update_data["updated_at"] = to_utc_naive(get_now())
 
         await self.db.execute(
             update(Courses).where(Courses.id == course_id).values(**update_data)
@@ -569,8 +569,8 @@ class CourseService:
                     .where(Courses.id == course_id)
                     .values(
                         embedding=vector,
-                        embedding_updated_at=await to_utc_naive(get_now()),
-                        updated_at=await to_utc_naive(get_now()),
+                        embedding_updated_at=to_utc_naive(get_now()),
+                        updated_at=to_utc_naive(get_now()),
                     )
                 )
                 await db.commit()
@@ -1,15 +1,21 @@
 # app/services/lecturer/lesson_service.py
 import asyncio
-import io
+import os
+import shutil
+import tempfile
+import time
 import uuid
-from asyncio.log import logger
 from datetime import datetime
-from typing import Any, List, Optional, Tuple
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
 from fastapi import BackgroundTasks, Depends, HTTPException, UploadFile
-from sqlalchemy import delete, desc, insert, select, update
+from fastapi.responses import ORJSONResponse
+from loguru import logger
+from sqlalchemy import delete, exists, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import raiseload, selectinload
 from starlette.datastructures import Headers
 from starlette.datastructures import UploadFile as UploadFile_starlette
 
@@ -31,7 +37,7 @@ from app.db.models.database import (
     SupportedLanguages,
     User,
 )
-from app.db.sesson import AsyncSessionLocal, get_session
+from app.db.sesson import AsyncSessionLocal, bulk_insert_rows, get_session
 from app.libs.formats.datetime import now as get_now, to_utc_naive
 from app.schemas.lecturer.lesson import (
     CreateLesson,
@@ -45,18 +51,33 @@ from app.schemas.lecturer.lesson import (
     UpdateLessonTitleSchema,
     UpdateLessonVideoSchema,
 )
-from app.services.shares.code_runner import PistonService
+from app.services.shares.code_runner import PistonService, get_piston_service
 from app.services.shares.google_driver import (
     GoogleDriveAsyncService,
     get_google_drive_service,
 )
+from app.services.shares.note_embedding import enqueue_note_embedding
 from app.services.shares.OCR_service import OCRService, get_ocr_service
-from app.services.shares.transcript_service import YoutubeTranscriptService
+from app.services.shares.transcript_service import (
+    YoutubeTranscriptService,
+    get_transcript_service,
+)
 from app.services.shares.youtube_uploader import (
     YouTubeAsyncService,
     get_youtube_service,
 )
 
+# Số file upload Drive chạy song song tối đa trong 1 request
+_DRIVE_UPLOAD_CONCURRENCY = 4
+# Số request embedding Gemini chạy song song tối đa cho 1 tài nguyên
+_EMBED_CONCURRENCY = 8
+# Số testcase chạy song song tối đa trên Piston (tránh rate limit)
+_PISTON_CONCURRENCY = 5
+
+# Cache bảng SupportedLanguages theo id (làm mới sau TTL giây)
+_LANG_CACHE_TTL = 60
+_LANG_CACHE: Dict[str, Any] = {"ts": 0.0, "by_id": {}}
+
 
 class LessonService:
 
@@ -66,7 +87,7 @@ class LessonService:
         google_drive: GoogleDriveAsyncService = Depends(get_google_drive_service),
         embedding: EmbeddingService = Depends(get_embedding_service),
         youtube: YouTubeAsyncService = Depends(get_youtube_service),
-        piston: PistonService = Depends(PistonService),
+        piston: PistonService = Depends(get_piston_service),
     ):
         self.db: AsyncSession = db
         self.google_drive: GoogleDriveAsyncService = google_drive
@@ -74,40 +95,94 @@ class LessonService:
         self.youtube: YouTubeAsyncService = youtube
         self.piston: PistonService = piston
 
+    async def _authorize_lesson(
+        self, lesson_id: uuid.UUID, lecturer_id: uuid.UUID | None
+    ) -> bool:
+        """
+        Chỉ lấy `Courses.instructor_id` của bài học (1 query join nhỏ).
+        - 404 nếu bài học / khóa học không tồn tại
+        - True nếu lecturer_id là giảng viên của khóa học
+        """
+        row = (
+            await self.db.execute(
+                select(Courses.instructor_id)
+                .join(CourseSections, CourseSections.course_id == Courses.id)
+                .join(Lessons, Lessons.section_id == CourseSections.id)
+                .where(Lessons.id == lesson_id)
+            )
+        ).first()
+        if row is None:
+            raise HTTPException(404, "❌ Không tìm thấy bài học")
+        return lecturer_id is not None and row.instructor_id == lecturer_id
+
+    async def _get_owned_course_id(
+        self, lesson_id: uuid.UUID, lecturer_id: uuid.UUID, forbidden_detail: str
+    ) -> uuid.UUID:
+        """
+        Trả course_id của bài học nếu giảng viên sở hữu khóa học (1 query join).
+        Chỉ khi không khớp mới probe thêm để phân biệt 404 / 403.
+        """
+        course_id = await self.db.scalar(
+            select(Lessons.course_id)
+            .join(Courses, Courses.id == Lessons.course_id)
+            .where(Lessons.id == lesson_id, Courses.instructor_id == lecturer_id)
+        )
+        if course_id is None:
+            exists = await self.db.scalar(
+                select(Lessons.id).where(Lessons.id == lesson_id)
+            )
+            if not exists:
+                raise HTTPException(404, "Không tìm thấy bài học")
+            raise HTTPException(403, forbidden_detail)
+        return course_id
+
     # 🧩 Tạo bài học (lesson)
     async def create_lesson_async(self, schema: CreateLesson, lecturer: User):
         try:
-            section = await self.db.scalar(
-                select(CourseSections).where(CourseSections.id == schema.section_id)
-            )
+            # Khóa dòng chương (FOR UPDATE) tới khi commit để các request tạo bài học
+            # đồng thời trong cùng chương không tính trùng max(position)
+            section = (
+                await self.db.execute(
+                    select(CourseSections.id, CourseSections.course_id)
+                    .where(CourseSections.id == schema.section_id)
+                    .with_for_update()
+                )
+            ).first()
             if not section:
                 raise HTTPException(
                     404, f"Không tìm thấy chương học {schema.section_id}"
                 )
 
-            course = await self.db.scalar(
-                select(Courses).where(
+            course_id = await self.db.scalar(
+                select(Courses.id).where(
                     Courses.id == section.course_id,
                     Courses.instructor_id == lecturer.id,
                 )
             )
-            if not course:
+            if not course_id:
                 raise HTTPException(
                     403, "Bạn không có quyền tạo bài học trong khóa học này"
                 )
 
-            last_lesson = await self.db.scalar(
-                select(Lessons)
+            # Vị trí mới = max(position) + 1, tính ngay trong câu INSERT
+            next_position = (
+                select(func.coalesce(func.max(Lessons.position), -1) + 1)
                 .where(Lessons.section_id == section.id)
-                .order_by(desc(Lessons.position))
+                .scalar_subquery()
+            )
+            new_lesson_id = await self.db.scalar(
+                insert(Lessons)
+                .values(
+                    **schema.model_dump(),
+                    course_id=course_id,
+                    position=next_position,
+                )
+                .returning(Lessons.id)
             )
-
-            new_lesson = Lessons(**schema.model_dump(), course_id=course.id)
-            new_lesson.position = (last_lesson.position + 1) if last_lesson else 0
-            self.db.add(new_lesson)
             await self.db.commit()
-            await self.db.refresh(new_lesson)
-            return {"message": "Tạo bài học thành công", "id": new_lesson.id}
+            return {"message": "Tạo bài học thành công", "id": new_lesson_id}
+        except HTTPException:
+            raise
         except Exception as e:
             await self.db.rollback()
             raise HTTPException(500, f"Lỗi khi tạo bài học: {e}")
@@ -117,22 +192,26 @@ class LessonService:
         🗑️ Xóa 1 bài học (toàn bộ dữ liệu con tự động bị xóa do ON DELETE CASCADE).
         """
         try:
-            # 1️⃣ Kiểm tra bài học tồn tại
-            lesson = await self.db.scalar(
-                select(Lessons).where(Lessons.id == lesson_id)
-            )
-            if not lesson:
-                raise HTTPException(404, "Không tìm thấy bài học để xóa")
-
-            # 2️⃣ Kiểm tra quyền giảng viên
-            course = await self.db.scalar(
-                select(Courses).where(Courses.id == lesson.course_id)
+            # 1️⃣ Xóa kèm điều kiện quyền giảng viên (DB tự xóa các bảng liên quan)
+            result = await self.db.execute(
+                delete(Lessons)
+                .where(
+                    Lessons.id == lesson_id,
+                    Lessons.course_id.in_(
+                        select(Courses.id).where(Courses.instructor_id == lecturer_id)
+                    ),
+                )
+                .returning(Lessons.id)
             )
-            if not course or course.instructor_id != lecturer_id:
+            if result.scalar_one_or_none() is None:
+                # 2️⃣ Nhánh hiếm: phân biệt 404 / 403
+                exists = await self.db.scalar(
+                    select(Lessons.id).where(Lessons.id == lesson_id)
+                )
+                if not exists:
+                    raise HTTPException(404, "Không tìm thấy bài học để xóa")
                 raise HTTPException(403, "Bạn không có quyền xóa bài học này")
 
-            # 3️⃣ Xóa chính bài học (DB tự xóa các bảng liên quan)
-            await self.db.execute(delete(Lessons).where(Lessons.id == lesson_id))
             await self.db.commit()
 
             return {"message": "✅ Đã xóa bài học thành công."}
@@ -149,35 +228,43 @@ class LessonService:
         lecturer_id: uuid.UUID,
         schema: UpdateLessonVideoSchema,
         background_tasks: BackgroundTasks,
+        defer_commit: bool = False,
     ):
+        """defer_commit=True → chỉ flush, để caller commit 1 lần cho cả transaction."""
         try:
             video_id = await self.youtube.extract_youtube_id(schema.video_url)
             # 1️⃣ Kiểm tra video đã tồn tại
             existing = await self.db.scalar(
-                select(LessonVideos).where(LessonVideos.lesson_id == lesson_id)
+                select(LessonVideos.id)
+                .where(LessonVideos.lesson_id == lesson_id)
+                .limit(1)
             )
             if existing:
                 raise HTTPException(409, "Video đã tồn tại cho bài học này")
 
-            # 2️⃣ Kiểm tra bài học và quyền giảng viên
-            lesson = await self.db.scalar(
-                select(Lessons)
-                .options(selectinload(Lessons.section))
-                .where(Lessons.id == lesson_id)
-            )
-            if not lesson:
+            # 2️⃣ Kiểm tra bài học và quyền giảng viên (lesson + course trong 1 query)
+            row = (
+                await self.db.execute(
+                    select(
+                        Lessons.id,
+                        Lessons.title,
+                        Lessons.description,
+                        Courses.title.label("course_title"),
+                        Courses.instructor_id,
+                    )
+                    .join(CourseSections, CourseSections.id == Lessons.section_id)
+                    .join(Courses, Courses.id == CourseSections.course_id)
+                    .where(Lessons.id == lesson_id)
+                )
+            ).first()
+            if not row:
                 raise HTTPException(404, "Không tồn tại bài học")
 
-            section = lesson.section
-            course = await self.db.scalar(
-                select(Courses).where(Courses.id == section.course_id)
-            )
-            if not course or course.instructor_id != lecturer_id:
+            if row.instructor_id != lecturer_id:
                 raise HTTPException(403, "Bạn không có quyền truy cập khóa học này")
-            video_id = await self.youtube.extract_youtube_id(schema.video_url)
             duration_seconds = await self.youtube.get_duration(video_id, False)
             lesson_video = LessonVideos(
-                lesson_id=lesson.id,
+                lesson_id=row.id,
                 file_id=video_id,
                 video_url=schema.video_url,
                 duration=duration_seconds,
@@ -185,7 +272,10 @@ class LessonService:
                 source_type="youtube_url",
             )
             self.db.add(lesson_video)
-            await self.db.commit()
+            if defer_commit:
+                await self.db.flush()
+            else:
+                await self.db.commit()
             await self.db.refresh(lesson_video)
 
             background_tasks.add_task(
@@ -214,50 +304,56 @@ class LessonService:
         background_tasks: BackgroundTasks,
     ):
         """
-        Upload video lên YouTube (theo dõi bằng lesson_id làm task_id) — chạy nền, không ghi ra disk.
+        Upload video lên YouTube (theo dõi bằng lesson_id làm task_id) — chạy nền.
+        Video được spool ra file tạm theo chunk, không giữ toàn bộ trong RAM.
         """
         try:
             # 1️⃣ Kiểm tra trùng video
             existing = await self.db.scalar(
-                select(LessonVideos).where(LessonVideos.lesson_id == lesson_id)
+                select(LessonVideos.id)
+                .where(LessonVideos.lesson_id == lesson_id)
+                .limit(1)
             )
             if existing:
-                raise HTTPException(
-                    status_code=409, detail="Video đã tồn tại cho bài học này"
-                )
+                raise HTTPException(409, "Video đã tồn tại cho bài học này")
 
-            # 2️⃣ Kiểm tra bài học và quyền giảng viên
-            lesson = await self.db.scalar(
-                select(Lessons)
-                .options(selectinload(Lessons.section))
-                .where(Lessons.id == lesson_id)
-            )
-            if not lesson:
+            # 2️⃣ Kiểm tra bài học và quyền giảng viên (lesson + course trong 1 query)
+            row = (
+                await self.db.execute(
+                    select(
+                        Lessons.id,
+                        Lessons.title,
+                        Lessons.description,
+                        Courses.title.label("course_title"),
+                        Courses.instructor_id,
+                    )
+                    .join(CourseSections, CourseSections.id == Lessons.section_id)
+                    .join(Courses, Courses.id == CourseSections.course_id)
+                    .where(Lessons.id == lesson_id)
+                )
+            ).first()
+            if not row:
                 raise HTTPException(404, "Không tồn tại bài học")
 
-            section = lesson.section
-            course = await self.db.scalar(
-                select(Courses).where(Courses.id == section.course_id)
-            )
-            if not course or course.instructor_id != lecturer_id:
+            if row.instructor_id != lecturer_id:
                 raise HTTPException(403, "Bạn không có quyền truy cập khóa học này")
 
-            # 3️⃣ Copy file vào RAM (giữ lại sau khi response kết thúc)
+            # 3️⃣ Spool file ra đĩa (UploadFile bị đóng khi response kết thúc)
             file_name = video.filename or "Không đọc được file name"
             content_type = video.content_type
-            file_bytes = await video.read()
+            tmp_path, _ = await asyncio.to_thread(self._spool_upload_to_disk, video)
             task_id = str(lesson_id)
 
             # 4️⃣ Tạo background task thật bằng asyncio
             asyncio.create_task(
-                LessonService.upload_video_background_in_memory(
+                LessonService.upload_video_background(
                     lesson_id,
-                    file_bytes,
+                    tmp_path,
                     file_name,
                     content_type,
                     task_id,
-                    f"{course.title} - {lesson.title}",
-                    f"Khóa học {course.title} | Bài học: {lesson.title} | mô tả {lesson.description}",
+                    f"{row.course_title} - {row.title}",
+                    f"Khóa học {row.course_title} | Bài học: {row.title} | mô tả {row.description}",
                 )
             )
 
@@ -270,87 +366,94 @@ class LessonService:
         except HTTPException:
             raise
         except Exception as e:
-            await self.db.rollback()
+            # Không có thao tác ghi DB ở đây → không cần rollback
             raise HTTPException(500, f"❌ Lỗi upload video: {e}")
 
     @staticmethod
-    async def upload_video_background_in_memory(
+    async def upload_video_background(
         lesson_id: uuid.UUID,
-        file_bytes: bytes,
+        file_path: str,
         filename: str,
         content_type: str | None,
         task_id: str,
         title: str,
         description: str = "",
     ):
-        youtube = YouTubeAsyncService()
-        headers = Headers({"content-type": content_type or "video/mp4"})
-
-        mem_file = UploadFile_starlette(
-            file=io.BytesIO(file_bytes),
-            filename=filename,
-            headers=headers,
-        )
+        """Đọc video từ file tạm theo chunk khi upload, xóa file tạm khi xong."""
+        disk_file: UploadFile_starlette | None = None
+        try:
+            youtube = await get_youtube_service()
+            headers = Headers({"content-type": content_type or "video/mp4"})
 
-        async with AsyncSessionLocal() as db:
-            try:
-                logger.info(
-                    f"🚀 Bắt đầu upload nền video: {filename} ({len(file_bytes)/1e6:.2f} MB)"
-                )
+            disk_file = UploadFile_starlette(
+                file=open(file_path, "rb"),
+                filename=filename,
+                headers=headers,
+            )
 
-                # 1️⃣ Upload lên YouTube (ẩn - unlisted)
-                result: dict[str, Any] = await youtube.upload_video_with_progress(
-                    file=mem_file,
-                    task_id=task_id,
-                    title=title,
-                    description=description,
-                )
+            async with AsyncSessionLocal() as db:
+                try:
+                    logger.info(
+                        f"🚀 Bắt đầu upload nền video: {filename} ({os.path.getsize(file_path)/1e6:.2f} MB)"
+                    )
 
-                video_id = str(result.get("video_id") or "")
-                video_url = str(result.get("video_url") or "")
-                if not video_id:
-                    raise RuntimeError(
-                        f"❌ Upload thất bại, không nhận được video_id ({result})"
+                    # 1️⃣ Upload lên YouTube (ẩn - unlisted)
+                    result: dict[str, Any] = await youtube.upload_video_with_progress(
+                        file=disk_file,
+                        task_id=task_id,
+                        title=title,
+                        description=description,
                     )
 
-                logger.info(f"✅ Upload hoàn tất: {video_url}")
+                    video_id = str(result.get("video_id") or "")
+                    video_url = str(result.get("video_url") or "")
+                    if not video_id:
+                        raise RuntimeError(
+                            f"❌ Upload thất bại, không nhận được video_id ({result})"
+                        )
 
-                # 2️⃣ Lấy độ dài video (chờ sẵn sàng)
-                duration = await youtube.get_duration(video_id, wait_first=True)
-                logger.info(f"⏱️ Độ dài video: {duration}s")
+                    logger.info(f"✅ Upload hoàn tất: {video_url}")
 
-                # 3️⃣ Lưu LessonVideos vào DB
-                lesson_video = LessonVideos(
-                    lesson_id=lesson_id,
-                    video_url=video_url,
-                    file_id=video_id,
-                    duration=duration,
-                    source_type="youtube_upload",
-                    transcript="",
-                )
-                db.add(lesson_video)
-                await db.commit()
-                logger.info(f"💾 Đã lưu LessonVideos cho bài học {lesson_id}")
-
-                # 4️⃣ Chờ YouTube xử lý ổn định trước khi gọi AI
-                delay_seconds = 300  # 👈 300 giây
-                logger.info(f"⏳ Chờ {delay_seconds}s để YouTube hoàn tất xử lý...")
-                await asyncio.sleep(delay_seconds)
+                    # 2️⃣ Lấy độ dài video (chờ sẵn sàng)
+                    duration = await youtube.get_duration(video_id, wait_first=True)
+                    logger.info(f"⏱️ Độ dài video: {duration}s")
 
-                # 5️⃣ Gọi xử lý phụ đề/mô tả (AI)
-                try:
-                    await LessonService.process_video_description_async(
-                        lesson_id, video_id
+                    # 3️⃣ Lưu LessonVideos vào DB
+                    lesson_video = LessonVideos(
+                        lesson_id=lesson_id,
+                        video_url=video_url,
+                        file_id=video_id,
+                        duration=duration,
+                        source_type="youtube_upload",
+                        transcript="",
                     )
-                    logger.info(f"🧠 Đã xử lý transcript/mô tả cho video {video_id}")
-                except Exception as sub_e:
-                    logger.warning(f"⚠️ Không thể xử lý transcript tự động: {sub_e}")
+                    db.add(lesson_video)
+                    await db.commit()
+                    logger.info(f"💾 Đã lưu LessonVideos cho bài học {lesson_id}")
 
-            except Exception as e:
-                await db.rollback()
-                logger.error(f"❌ Lỗi upload nền: {e}", exc_info=True)
-            finally:
-                mem_file.file.close()
+                    # 4️⃣ Chờ YouTube xử lý ổn định trước khi gọi AI
+                    delay_seconds = 300  # 👈 300 giây
+                    logger.info(f"⏳ Chờ {delay_seconds}s để YouTube hoàn tất xử lý...")
+                    await asyncio.sleep(delay_seconds)
+
+                    # 5️⃣ Gọi xử lý phụ đề/mô tả (AI)
+                    try:
+                        await LessonService.process_video_description_async(
+                            lesson_id, video_id
+                        )
+                        logger.info(f"🧠 Đã xử lý transcript/mô tả cho video {video_id}")
+                    except Exception as sub_e:
+                        logger.warning(f"⚠️ Không thể xử lý transcript tự động: {sub_e}")
+
+                except Exception as e:
+                    await db.rollback()
+                    logger.exception(f"❌ Lỗi upload nền: {e}")
+        finally:
+            # Dọn file tạm cả khi lỗi xảy ra trước lúc upload (lấy service / mở file)
+            if disk_file is not None:
+                disk_file.file.close()
+            if os.path.exists(file_path):
+                os.unlink(file_path)
 
     @staticmethod
     async def process_video_description_async(
@@ -367,16 +470,22 @@ class LessonService:
                 
                 # Lấy transcript service nếu chưa có
                 if transcript_service is None:
-                    transcript_service = YoutubeTranscriptService()
+                    transcript_service = get_transcript_service()
 
                 # 🧠 1. Trích ngữ cảnh từ video
                 description = await transcript_service.extract_video_context(video_id)
-                print("🧠 Gemini mô tả:", description[:200], "...")
+                logger.info(f"🧠 Gemini mô tả: {description[:200]} ...")
 
-                total_tokens = embedding.estimate_tokens(description)
-                lesson_embedding = await embedding.embed_google_normalized(description)
-                chunks = embedding.split_text_by_tokens(
-                    description, chunk_size=1000, overlap=100
+                # Tokenize 1 lần: chunk + số token từng chunk + tổng token
+                chunks, token_counts, total_tokens = (
+                    embedding.split_text_with_token_counts(
+                        description, chunk_size=1000, overlap=100
+                    )
+                )
+
+                # Embedding mô tả + toàn bộ chunk theo lô (1 API call / 100 đoạn)
+                lesson_embedding, *chunk_embeds = (
+                    await embedding.embed_google_normalized_batch([description, *chunks])
                 )
 
                 await db.execute(
@@ -393,33 +502,30 @@ class LessonService:
                     .values(transcript=description)
                 )
 
-                lesson_chunks_payload = []
-
-                lesson_chunks_payload = []
-                for idx, chunk_text in enumerate(chunks):
-                    chunk_embed = await embedding.embed_google_normalized(chunk_text)
-                    lesson_chunks_payload.append(
-                        LessonChunks(
-                            lesson_id=lesson_id,
-                            chunk_index=idx,
-                            text_=chunk_text,
-                            embedding=chunk_embed,
-                            token_count=embedding.estimate_tokens(chunk_text),
-                        )
+                lesson_chunks_payload = [
+                    {
+                        "lesson_id": lesson_id,
+                        "chunk_index": idx,
+                        "text_": chunk_text,
+                        "embedding": chunk_embed,
+                        "token_count": token_count,
+                    }
+                    for idx, (chunk_text, chunk_embed, token_count) in enumerate(
+                        zip(chunks, chunk_embeds, token_counts)
                     )
+                ]
 
-                db.add_all(lesson_chunks_payload)
+                # Insert 1 lần (multi-row) thay vì từng object qua ORM
+                if lesson_chunks_payload:
+                    await db.execute(insert(LessonChunks), lesson_chunks_payload)
                 await db.commit()
-                print(
+                logger.info(
                     f"✅ [{lesson_id}] xử lý xong ({len(chunks)} chunks, {total_tokens} tokens)"
                 )
 
             except Exception as e:
                 await db.rollback()
-                import traceback
-
-                traceback.print_exc()
-                print(f"❌ Lỗi khi xử lý bài học {lesson_id}: {e}")
+                logger.exception(f"❌ Lỗi khi xử lý bài học {lesson_id}: {e}")
 
     async def move_lesson_async(
         self, lesson_id: uuid.UUID, schema: MoveLessonSchema, lecturer_id: uuid.UUID
@@ -428,17 +534,19 @@ class LessonService:
         ✅ Di chuyển bài học sang chương khác hoặc đổi vị trí trong cùng chương.
         - Cập nhật lại position cho cả chương cũ và chương mới.
         """
-        # kieerm tra quyen cua ngoi dung
-
-        # 1️⃣ Lấy thông tin bài học hiện tại
+        # 1️⃣ Lấy bài học kèm kiểm tra quyền giảng viên trong 1 query
         lesson: Lessons | None = await self.db.scalar(
             select(Lessons)
-            .options(selectinload(Lessons.course))
-            .where(Lessons.id == lesson_id)
+            .join(Courses, Courses.id == Lessons.course_id)
+            .where(Lessons.id == lesson_id, Courses.instructor_id == lecturer_id)
         )
         if not lesson:
-            raise HTTPException(status_code=404, detail="Không tìm thấy bài học")
-        if lesson.course and lesson.course.instructor_id != lecturer_id:
+            # Nhánh hiếm: phân biệt 404 / 403
+            exists = await self.db.scalar(
+                select(Lessons.id).where(Lessons.id == lesson_id)
+            )
+            if not exists:
+                raise HTTPException(404, "Không tìm thấy bài học")
             raise HTTPException(
                 status_code=403, detail="Bạn không có quyền truy cập bài học này"
             )
@@ -453,45 +561,60 @@ class LessonService:
         if not target_section:
             raise HTTPException(status_code=404, detail="Không tìm thấy chương đích")
 
-        # 3️⃣ Lấy danh sách bài học trong chương đích
-        result = await self.db.scalars(
-            select(Lessons.id)
-            .where(Lessons.section_id == new_section_id)
-            .order_by(Lessons.position)
+        old_pos = lesson.position
+
+        # 3️⃣ Đếm số bài học trong chương đích để giới hạn vị trí chèn
+        target_count = await self.db.scalar(
+            select(func.count(Lessons.id)).where(Lessons.section_id == new_section_id)
         )
-        lessons_target = list(result)
+        target_count = target_count or 0
 
-        # 4️⃣ Nếu đang di chuyển trong cùng chương → bỏ id cũ trước khi chèn
-        if old_section_id == new_section_id and lesson_id in lessons_target:
-            lessons_target.remove(lesson_id)
-        else:
-            # 4b️⃣ Nếu di chuyển sang chương mới → xóa khỏi chương cũ
-            old_result = await self.db.scalars(
-                select(Lessons.id)
-                .where(Lessons.section_id == old_section_id)
-                .order_by(Lessons.position)
-            )
-            lessons_old = list(old_result)
-            if lesson_id in lessons_old:
-                lessons_old.remove(lesson_id)
-            # Reindex lại chương cũ
-            for idx, lid in enumerate(lessons_old):
+        if old_section_id == new_section_id:
+            # 4️⃣ Cùng chương → chỉ dịch các bài nằm giữa vị trí cũ và mới
+            new_pos = max(0, min(schema.position, target_count - 1))
+            if new_pos > old_pos:
                 await self.db.execute(
-                    update(Lessons).where(Lessons.id == lid).values(position=idx)
+                    update(Lessons)
+                    .where(
+                        Lessons.section_id == new_section_id,
+                        Lessons.position > old_pos,
+                        Lessons.position <= new_pos,
+                    )
+                    .values(position=Lessons.position - 1)
                 )
-
-        # 5️⃣ Chèn lesson vào vị trí mới trong chương đích
-        insert_pos = max(0, min(schema.position, len(lessons_target)))
-        lessons_target.insert(insert_pos, lesson_id)
-
-        # 6️⃣ Reindex toàn bộ chương đích
-        for idx, lid in enumerate(lessons_target):
+            elif new_pos < old_pos:
+                await self.db.execute(
+                    update(Lessons)
+                    .where(
+                        Lessons.section_id == new_section_id,
+                        Lessons.position >= new_pos,
+                        Lessons.position < old_pos,
+                    )
+                    .values(position=Lessons.position + 1)
+                )
+        else:
+            # 4b️⃣ Khác chương → dồn chương cũ lên, chừa chỗ trong chương đích
+            new_pos = max(0, min(schema.position, target_count))
             await self.db.execute(
                 update(Lessons)
-                .where(Lessons.id == lid)
-                .values(section_id=new_section_id, position=idx)
+                .where(Lessons.section_id == old_section_id, Lessons.position > old_pos)
+                .values(position=Lessons.position - 1)
+            )
+            await self.db.execute(
+                update(Lessons)
+                .where(
+                    Lessons.section_id == new_section_id, Lessons.position >= new_pos
+                )
+                .values(position=Lessons.position + 1)
             )
 
+        # 5️⃣ Đặt bài học vào vị trí mới
+        await self.db.execute(
+            update(Lessons)
+            .where(Lessons.id == lesson_id)
+            .values(section_id=new_section_id, position=new_pos)
+        )
+
         await self.db.commit()
         return {"detail": "Di chuyển bài học thành công"}
 
@@ -505,27 +628,28 @@ class LessonService:
         ✅ Cập nhật tên bài học và tự động viết lại slug theo title mới.
         - Giữ nguyên section_id, order_index, các trường khác.
         """
-        # 1️⃣ Kiểm tra bài học tồn tại
-        lesson = await self.db.scalar(select(Lessons).where(Lessons.id == lesson_id))
-        if not lesson:
-            raise HTTPException(status_code=404, detail="Không tìm thấy bài học")
-
-        # 2️⃣ Kiểm tra quyền giảng viên
-        course: Courses | None = await self.db.scalar(
-            select(Courses).where(Courses.id == lesson.course_id)
+        # 1️⃣ Kiểm tra bài học + quyền giảng viên trong 1 query
+        owned_lesson_id = await self.db.scalar(
+            select(Lessons.id)
+            .join(Courses, Courses.id == Lessons.course_id)
+            .where(Lessons.id == lesson_id, Courses.instructor_id == lecturer_id)
         )
-        if not course:
-            raise HTTPException(status_code=404, detail="Không tìm thấy khóa học")
-        if course.instructor_id != lecturer_id:
+        if not owned_lesson_id:
+            # Nhánh hiếm: phân biệt 404 / 403
+            exists = await self.db.scalar(
+                select(Lessons.id).where(Lessons.id == lesson_id)
+            )
+            if not exists:
+                raise HTTPException(404, "Không tìm thấy bài học")
             raise HTTPException(
                 status_code=403, detail="Bạn không có quyền truy cập bài học này"
             )
-        # 4️⃣ Cập nhật title + slug
+        # 2️⃣ Cập nhật title + slug
         await self.db.execute(
             update(Lessons)
             .where(Lessons.id == lesson_id)
             .values(
-                title=schema.title, updated_at=await to_utc_naive(get_now())
+                title=schema.title, updated_at=to_utc_naive(get_now())
             )
         )
         await self.db.commit()
@@ -537,7 +661,7 @@ class LessonService:
         # 1️⃣ Kiểm tra bài học tồn tại
         lesson = await self.db.scalar(select(Lessons).where(Lessons.id == lesson_id))
         if not lesson:
-            raise HTTPException(status_code=404, detail="Không tìm thấy bài học")
+            raise HTTPException(404, "Không tìm thấy bài học")
 
         # 2️⃣ Lấy toàn bộ tài nguyên thuộc bài học
         resources = await self.db.scalars(
@@ -573,88 +697,127 @@ class LessonService:
     ):
         """Upload file hoặc thêm link -> lưu DB -> giao background xử lý embedding."""
 
-        lesson = await self.db.scalar(select(Lessons).where(Lessons.id == lesson_id))
-        if not lesson:
+        row = (
+            await self.db.execute(
+                select(Lessons, Courses)
+                .join(Courses, Courses.id == Lessons.course_id)
+                .where(Lessons.id == lesson_id)
+            )
+        ).first()
+        if not row:
             raise HTTPException(404, "Không tìm thấy bài học")
-        course = await self.db.scalar(
-            select(Courses).where(Courses.id == lesson.course_id)
-        )
-        if not course or course.instructor_id != lecturer_id:
+        lesson, course = row
+        if course.instructor_id != lecturer_id:
             raise HTTPException(403, "Bạn không có quyền truy cập khóa học này")
-        created_resources: List[
-            Tuple[LessonResources, Optional[bytes], Optional[str]]
-        ] = []
-
-        if files:
-            for file in files:
-                content = await file.read()
-                filename = f"{uuid.uuid4().hex}_{file.filename}"
-                content_type = file.content_type or "application/octet-stream"
-
-                uploaded = await self.google_drive.upload_file(
-                    path_parts=[
-                        "courses",
-                        str(lesson.course_id),
-                        "lessons",
-                        str(lesson_id),
-                        "resources",
-                    ],
-                    content=content,
-                    file_name=filename,
-                    mime_type=content_type,
+        now = to_utc_naive(get_now())
+        sem = asyncio.Semaphore(_DRIVE_UPLOAD_CONCURRENCY)
+
+        async def _upload_one(file: UploadFile) -> Tuple[dict, str]:
+            async with sem:
+                # Ghi file tạm ra đĩa theo từng chunk, không giữ bytes trong RAM
+                tmp_path, file_size = await asyncio.to_thread(
+                    LessonService._spool_upload_to_disk, file
                 )
+                try:
+                    filename = f"{uuid.uuid4().hex}_{file.filename}"
+                    content_type = file.content_type or "application/octet-stream"
+
+                    with open(tmp_path, "rb") as fh:
+                        uploaded = await self.google_drive.upload_file(
+                            path_parts=[
+                                "courses",
+                                str(lesson.course_id),
+                                "lessons",
+                                str(lesson_id),
+                                "resources",
+                            ],
+                            content=fh,
+                            file_name=filename,
+                            mime_type=content_type,
+                        )
+                except Exception:
+                    os.unlink(tmp_path)
+                    raise
 
-                file_id = uploaded.get("id")
-                web_link = (
-                    uploaded.get("webViewLink")
-                    or f"https://drive.google.com/file/d/{file_id}/view"
-                )
+            file_id = uploaded.get("id")
+            web_link = (
+                uploaded.get("webViewLink")
+                or f"https://drive.google.com/file/d/{file_id}/view"
+            )
+            row = {
+                "id": uuid.uuid4(),
+                "lesson_id": lesson_id,
+                "resource_type": ocr_pdf_service._detect_type(content_type),
+                "title": file.filename,
+                "url": web_link,
+                "mime_type": content_type,
+                "file_size": file_size,
+                "embed_status": "processing",
+                "created_at": now,
+                "updated_at": now,
+            }
+            return row, tmp_path
 
-                resource = LessonResources(
-                    id=uuid.uuid4(),
-                    lesson_id=lesson_id,
-                    resource_type=await ocr_pdf_service._detect_type(content_type),
-                    title=file.filename,
-                    url=web_link,
-                    mime_type=content_type,
-                    file_size=len(content),
-                    embed_status="processing",
-                    created_at=await to_utc_naive(get_now()),
-                    updated_at=await to_utc_naive(get_now()),
+        # 1️⃣ Upload song song lên Drive (giới hạn bởi semaphore)
+        results = await asyncio.gather(
+            *(_upload_one(f) for f in files or []), return_exceptions=True
+        )
+        uploaded_rows = [r for r in results if not isinstance(r, BaseException)]
+        errors = [r for r in results if isinstance(r, BaseException)]
+
+        # 2️⃣ Lưu DB 1 lần bằng bulk INSERT
+        try:
+            if errors:
+                raise errors[0]
+            if uploaded_rows:
+                await self.db.execute(
+                    insert(LessonResources), [row for row, _ in uploaded_rows]
                 )
-                self.db.add(resource)
-                created_resources.append((resource, content, file.filename))
-        await self.db.commit()
+            await self.db.commit()
+        except Exception:
+            # Dọn file tạm nếu request lỗi giữa chừng
+            for _, tmp_path in uploaded_rows:
+                os.unlink(tmp_path)
+            raise
 
         # =====================================
-        # ⚙️ Giao background xử lý embedding
+        # ⚙️ Giao background xử lý embedding (chỉ truyền đường dẫn file tạm)
         # =====================================
-        for resource, content, filename in created_resources:
+        for row, tmp_path in uploaded_rows:
             background_tasks.add_task(
                 LessonService._process_embedding_for_resource_task,
-                str(resource.id),
-                content,
-                filename,
+                str(row["id"]),
+                tmp_path,
+                row["title"],
             )
 
         return {
-            "message": f"✅ Đã thêm {len(created_resources)} tài nguyên, embedding sẽ xử lý nền",
+            "message": f"✅ Đã thêm {len(uploaded_rows)} tài nguyên, embedding sẽ xử lý nền",
             "resources": [
                 {
-                    "id": str(r.id),
-                    "title": r.title,
-                    "url": r.url,
-                    "resource_type": r.resource_type,
-                    "mime_type": r.mime_type,
-                    "embed_status": r.embed_status,
+                    "id": str(r["id"]),
+                    "title": r["title"],
+                    "url": r["url"],
+                    "resource_type": r["resource_type"],
+                    "mime_type": r["mime_type"],
+                    "embed_status": r["embed_status"],
                 }
-                for r, _, _ in created_resources
+                for r, _ in uploaded_rows
             ],
         }
 
+    @staticmethod
+    def _spool_upload_to_disk(file: UploadFile) -> Tuple[str, int]:
+        """Copy UploadFile ra file tạm theo chunk 1MB, trả (đường dẫn, kích thước)."""
+        suffix = os.path.splitext(file.filename or "")[1]
+        file.file.seek(0)
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
+            shutil.copyfileobj(file.file, tmp, length=1 << 20)
+            return tmp.name, tmp.tell()
+
     @staticmethod
     async def _process_embedding_for_resource_task(
-        resource_id: str, content: Optional[bytes], filename: Optional[str]
+        resource_id: str, file_path: Optional[str], filename: Optional[str]
     ):
         from app.db.models.database import LessonResources
 
@@ -666,17 +829,18 @@ class LessonService:
                     )
                 )
                 if not resource:
-                    print(f"⚠️ Không tìm thấy resource {resource_id}")
+                    logger.warning(f"⚠️ Không tìm thấy resource {resource_id}")
                     return
 
                 # =====================================
                 # 📄 Đọc nội dung file hoặc OCR
                 # =====================================
                 text_content = ""
-                if content and filename:
+                if file_path and filename:
                     ocr = get_ocr_service()
                     if filename.lower().endswith((".pdf", ".png", ".jpg", ".jpeg")):
-                        text_content = ocr.extract_text_from_pdf(content)
+                        # OCR nặng CPU → raster/OCR chạy trong thread, không chặn event loop
+                        text_content = await ocr.extract_text_from_pdf(Path(file_path))
                 else:
                     resource.embed_status = "skipped"
                     await db.commit()
@@ -691,34 +855,54 @@ class LessonService:
                 # ✂️ Tách chunk + nhúng embedding
                 # =====================================
                 embedding = await get_embedding_service()
-                chunks = embedding.split_text_by_tokens(
+                chunks, token_counts, _ = embedding.split_text_with_token_counts(
                     text_content, chunk_size=1500, overlap=150
                 )
 
-                for idx, chunk_text in enumerate(chunks):
-                    vector = await embedding.embed_google_normalized(chunk_text)
-                    chunk = ResourceChunks(
-                        id=uuid.uuid4(),
-                        resource_id=resource.id,
-                        lesson_id=resource.lesson_id,
-                        chunk_index=idx,
-                        chunk_type="text",
-                        content=chunk_text,
-                        token_count=len(chunk_text.split()),
-                        embedding=vector,
-                        created_at=get_now(),
+                # Nhúng song song các chunk (giới hạn bởi semaphore)
+                sem = asyncio.Semaphore(_EMBED_CONCURRENCY)
+
+                async def _embed(chunk_text: str) -> list[float]:
+                    async with sem:
+                        return await embedding.embed_google_normalized(chunk_text)
+
+                vectors = await asyncio.gather(*(_embed(c) for c in chunks))
+
+                now = get_now()
+                chunk_rows = [
+                    {
+                        "id": uuid.uuid4(),
+                        "resource_id": resource.id,
+                        "lesson_id": resource.lesson_id,
+                        "chunk_index": idx,
+                        "chunk_type": "text",
+                        "content": chunk_text,
+                        "token_count": token_count,
+                        "embedding": vector,
+                        "created_at": now,
+                    }
+                    for idx, (chunk_text, vector, token_count) in enumerate(
+                        zip(chunks, vectors, token_counts)
                     )
-                    db.add(chunk)
+                ]
 
-                resource.embed_status = "done"
-                resource.updated_at = get_now()
+                if chunk_rows:
+                    await db.execute(insert(ResourceChunks), chunk_rows)
+
+                # 1 câu UPDATE trạng thái, không phụ thuộc thứ tự flush của ORM
+                await db.execute(
+                    update(LessonResources)
+                    .where(LessonResources.id == resource.id)
+                    .values(embed_status="done", updated_at=now)
+                )
                 await db.commit()
 
-                print(f"✅ [{resource_id}] Đã nhúng embedding thành công")
+                logger.info(f"✅ [{resource_id}] Đã nhúng embedding thành công")
 
             except Exception as e:
+                # Luôn rollback: kể cả lỗi ở câu SELECT đầu, transaction có thể đã aborted
                 await db.rollback()
-                print(f"❌ Lỗi embedding resource {resource_id}: {e}")
+                logger.exception(f"❌ Lỗi embedding resource {resource_id}: {e}")
                 # Gắn cờ lỗi cho DB
                 try:
                     await db.execute(
@@ -727,8 +911,14 @@ class LessonService:
                         .values(embed_status="error")
                     )
                     await db.commit()
-                except Exception:
-                    pass
+                except Exception as mark_err:
+                    await db.rollback()
+                    logger.exception(
+                        f"❌ Không đánh dấu được embed_status=error cho resource {resource_id}: {mark_err}"
+                    )
+            finally:
+                if file_path and os.path.exists(file_path):
+                    os.unlink(file_path)
 
     async def add_resources_link_async(
         self,
@@ -738,16 +928,12 @@ class LessonService:
     ):
         """Thêm link tài nguyên -> lưu DB (không cần embedding)."""
 
-        lesson = await self.db.scalar(select(Lessons).where(Lessons.id == lesson_id))
-        if not lesson:
-            raise HTTPException(404, "Không tìm thấy bài học")
-        course = await self.db.scalar(
-            select(Courses).where(Courses.id == lesson.course_id)
+        await self._get_owned_course_id(
+            lesson_id, lecturer_id, "Bạn không có quyền truy cập khóa học này"
         )
-        if not course or course.instructor_id != lecturer_id:
-            raise HTTPException(403, "Bạn không có quyền truy cập khóa học này")
 
         created_resources: List[LessonResources] = []
+        now = to_utc_naive(get_now())
 
         for link in links:
             resource = LessonResources(
@@ -759,8 +945,8 @@ class LessonService:
                 mime_type="text/link",
                 file_size=0,
                 embed_status="skipped",
-                created_at=await to_utc_naive(get_now()),
-                updated_at=await to_utc_naive(get_now()),
+                created_at=now,
+                updated_at=now,
             )
             self.db.add(resource)
             created_resources.append(resource)
@@ -790,71 +976,83 @@ class LessonService:
     ):
         """Thêm file tài nguyên dạng ZIP/RAR -> lưu DB (không cần embedding)."""
 
-        # 1️⃣ Kiểm tra bài học và quyền giảng viên
-        lesson = await self.db.scalar(select(Lessons).where(Lessons.id == lesson_id))
-        if not lesson:
-            raise HTTPException(404, "Không tìm thấy bài học")
-
-        course = await self.db.scalar(
-            select(Courses).where(Courses.id == lesson.course_id)
+        # 1️⃣ Kiểm tra bài học và quyền giảng viên (1 query)
+        course_id = await self._get_owned_course_id(
+            lesson_id, lecturer_id, "Bạn không có quyền truy cập khóa học này"
         )
-        if not course or course.instructor_id != lecturer_id:
-            raise HTTPException(403, "Bạn không có quyền truy cập khóa học này")
 
-        created_resources: List[LessonResources] = []
-        now = await to_utc_naive(get_now())
+        now = to_utc_naive(get_now())
+        sem = asyncio.Semaphore(_DRIVE_UPLOAD_CONCURRENCY)
 
-        for file in files:
+        async def _upload_one(file: UploadFile) -> LessonResources:
             try:
-                content = await file.read()
-                filename = f"{uuid.uuid4().hex}_{file.filename}"
-                content_type = file.content_type or "application/octet-stream"
-
-                # Nhận diện loại file (zip/rar/7z)
-                filename_lower = file.filename.lower()
-                if filename_lower.endswith((".zip", ".rar", ".7z")):
-                    resource_type = "archive"
-                else:
-                    resource_type = "file"
-
-                uploaded = await self.google_drive.upload_file(
-                    path_parts=[
-                        "courses",
-                        str(lesson.course_id),
-                        "lessons",
-                        str(lesson_id),
-                        "resources",
-                    ],
-                    content=content,
-                    file_name=filename,
-                    mime_type=content_type,
-                )
+                async with sem:
+                    filename = f"{uuid.uuid4().hex}_{file.filename}"
+                    content_type = file.content_type or "application/octet-stream"
+
+                    # Copy theo chunk vào spool (RAM tối đa 4MB, lớn hơn tự ghi ra đĩa)
+                    # trong thread → ghi đĩa không chặn event loop
+                    with tempfile.SpooledTemporaryFile(max_size=4 * 1024 * 1024) as spool:
+                        await file.seek(0)
+                        await asyncio.to_thread(
+                            shutil.copyfileobj, file.file, spool, 1 << 20
+                        )
+                        file_size = spool.tell()
+                        spool.seek(0)
+
+                        uploaded = await self.google_drive.upload_file(
+                            path_parts=[
+                                "courses",
+                                str(course_id),
+                                "lessons",
+                                str(lesson_id),
+                                "resources",
+                            ],
+                            content=spool,
+                            file_name=filename,
+                            mime_type=content_type,
+                        )
+            except Exception as e:
+                raise HTTPException(500, f"❌ Lỗi upload {file.filename}: {e}")
 
-                file_id = uploaded.get("id")
-                web_link = (
-                    uploaded.get("webViewLink")
-                    or f"https://drive.google.com/file/d/{file_id}/view"
-                )
+            # Nhận diện loại file (zip/rar/7z)
+            filename_lower = file.filename.lower()
+            if filename_lower.endswith((".zip", ".rar", ".7z")):
+                resource_type = "archive"
+            else:
+                resource_type = "file"
 
-                resource = LessonResources(
-                    id=uuid.uuid4(),
-                    lesson_id=lesson_id,
-                    resource_type=resource_type,
-                    title=file.filename,
-                    url=web_link,
-                    mime_type=content_type,
-                    file_size=len(content),
-                    embed_status="skipped",
-                    created_at=now,
-                    updated_at=now,
-                )
-                self.db.add(resource)
-                created_resources.append(resource)
+            file_id = uploaded.get("id")
+            web_link = (
+                uploaded.get("webViewLink")
+                or f"https://drive.google.com/file/d/{file_id}/view"
+            )
 
-            except Exception as e:
-                await self.db.rollback()
-                raise HTTPException(500, f"❌ Lỗi upload {file.filename}: {e}")
+            return LessonResources(
+                id=uuid.uuid4(),
+                lesson_id=lesson_id,
+                resource_type=resource_type,
+                title=file.filename,
+                url=web_link,
+                mime_type=content_type,
+                file_size=file_size,
+                embed_status="skipped",
+                created_at=now,
+                updated_at=now,
+            )
 
+        # 2️⃣ Upload song song lên Drive (giới hạn bởi semaphore)
+        results = await asyncio.gather(
+            *(_upload_one(f) for f in files), return_exceptions=True
+        )
+        for r in results:
+            # Chưa ghi gì vào session → không cần rollback
+            if isinstance(r, BaseException):
+                raise r
+
+        # 3️⃣ Lưu DB 1 lần
+        created_resources: List[LessonResources] = list(results)
+        self.db.add_all(created_resources)
         await self.db.commit()
 
         return {
@@ -877,27 +1075,27 @@ class LessonService:
     ):
         """Xóa 1 resource theo id (async)."""
         try:
-            # 1️⃣ Kiểm tra tồn tại
-            existing = await self.db.scalar(
-                select(LessonResources).where(LessonResources.id == resource_id)
-            )
-
-            if not existing:
-                raise HTTPException(404, "❌ Không tìm thấy tài nguyên để xóa.")
-
-            isAuth = await self.db.scalar(
-                select(Courses)
-                .join(Lessons, Lessons.course_id == Courses.id)
-                .where(Lessons.id == existing.lesson_id)
+            # 1️⃣ Xóa kèm điều kiện quyền giảng viên trong 1 câu DELETE
+            deleted = await self.db.scalar(
+                delete(LessonResources)
+                .where(
+                    LessonResources.id == resource_id,
+                    LessonResources.lesson_id.in_(
+                        select(Lessons.id)
+                        .join(Courses, Courses.id == Lessons.course_id)
+                        .where(Courses.instructor_id == lecture_id)
+                    ),
+                )
+                .returning(LessonResources.id)
             )
-            if not isAuth:
-                raise HTTPException(404, "❌ Bài học không tồn tại.")
-            if isAuth.instructor_id != lecture_id:
+            if deleted is None:
+                # 2️⃣ Nhánh hiếm: phân biệt 404 / 403
+                exists = await self.db.scalar(
+                    select(LessonResources.id).where(LessonResources.id == resource_id)
+                )
+                if not exists:
+                    raise HTTPException(404, "❌ Không tìm thấy tài nguyên để xóa.")
                 raise HTTPException(403, "❌ Bạn không có quyền xóa tài nguyên này.")
-            # 2️⃣ Xóa
-            await self.db.execute(
-                delete(LessonResources).where(LessonResources.id == resource_id)
-            )
             await self.db.commit()
 
             logger.info(f"🗑️ Đã xóa resource: {resource_id}")
@@ -926,105 +1124,152 @@ class LessonService:
 
         quizzes = await self.db.scalars(
             select(LessonQuizzes)
-            .options(selectinload(LessonQuizzes.lesson_quiz_options))
+            .options(selectinload(LessonQuizzes.lesson_quiz_options), raiseload("*"))
             .where(LessonQuizzes.lesson_id == lesson_id)
         )
 
         quizzes = quizzes.all()
-        if not quizzes:
-            return []
 
-        return [
-            {
-                "id": str(q.id),
-                "question": q.question,
-                "explanation": q.explanation,
-                "difficulty_level": q.difficulty_level,
-                "options": [
-                    {
-                        "id": str(o.id),
-                        "text": o.text_,
-                        "is_correct": o.is_correct,
-                        "feedback": o.feedback,
-                        "position": o.position,
-                    }
-                    for o in q.lesson_quiz_options
-                ],
-            }
-            for q in quizzes
-        ]
+        # Trả thẳng ORJSONResponse: orjson tự serialize UUID, bỏ qua jsonable_encoder
+        return ORJSONResponse(
+            [
+                {
+                    "id": q.id,
+                    "question": q.question,
+                    "explanation": q.explanation,
+                    "difficulty_level": q.difficulty_level,
+                    "options": [
+                        {
+                            "id": o.id,
+                            "text": o.text_,
+                            "is_correct": o.is_correct,
+                            "feedback": o.feedback,
+                            "position": o.position,
+                        }
+                        for o in q.lesson_quiz_options
+                    ],
+                }
+                for q in quizzes
+            ]
+        )
+
+    @staticmethod
+    def _build_quiz_rows(
+        schema: LessonQuizBulkCreate,
+        course_id: uuid.UUID | None,
+        now: datetime,
+        known_quiz_ids: set | None = None,
+        known_option_ids: set | None = None,
+    ) -> Tuple[List[dict], List[dict]]:
+        """
+        Dựng sẵn rows (dict) cho quiz + options, id sinh phía Python.
+        Id client gửi lên chỉ được giữ nếu nằm trong known_*_ids (thuộc bài học này)
+        và chưa dùng cho row trước đó trong payload; id lặp lại được sinh id mới.
+        """
+        known_quiz_ids = known_quiz_ids or set()
+        known_option_ids = known_option_ids or set()
+        used_quiz_ids: set = set()
+        used_option_ids: set = set()
+
+        def _pick_id(client_id, known: set, used: set) -> uuid.UUID:
+            new_id = (
+                client_id
+                if client_id in known and client_id not in used
+                else uuid.uuid4()
+            )
+            used.add(new_id)
+            return new_id
+
+        quiz_rows: List[dict] = []
+        option_rows: List[dict] = []
+        for quiz_data in schema.quizzes:
+            quiz_id = _pick_id(quiz_data.id, known_quiz_ids, used_quiz_ids)
+            quiz_rows.append(
+                {
+                    "id": quiz_id,
+                    "lesson_id": schema.lesson_id,
+                    "course_id": course_id,
+                    "question": quiz_data.question.strip(),
+                    "explanation": quiz_data.explanation or "",
+                    "difficulty_level": quiz_data.difficulty_level or 1,
+                    "created_by": schema.created_by,
+                    "created_at": now,
+                }
+            )
+            option_rows.extend(
+                {
+                    "id": _pick_id(opt.id, known_option_ids, used_option_ids),
+                    "quiz_id": quiz_id,
+                    "text_": opt.text.strip(),
+                    "is_correct": opt.is_correct,
+                    "feedback": opt.feedback,
+                    "position": opt.position or i,
+                    "created_at": now,
+                }
+                for i, opt in enumerate(quiz_data.options, start=1)
+            )
+        return quiz_rows, option_rows
+
+    async def _insert_quiz_rows(
+        self, quiz_rows: List[dict], option_rows: List[dict]
+    ) -> None:
+        """Ghi quiz rồi options, mỗi bảng 1 câu INSERT (executemany)."""
+        if quiz_rows:
+            await self.db.execute(insert(LessonQuizzes), quiz_rows)
+        await bulk_insert_rows(self.db, LessonQuizOptions, option_rows)
 
     async def create_quizzes_bulk_async(
         self, lecturer_id: uuid.UUID, schema: LessonQuizBulkCreate
     ):
         """🧠 Tạo nhiều quiz cùng lúc cho 1 bài học"""
-        lesson = await self.db.scalar(
-            select(Lessons).where(Lessons.id == schema.lesson_id)
-        )
-        if not lesson:
-            raise HTTPException(404, "Không tìm thấy bài học")
+        # Không có quiz nào → không cần chạm DB
+        if not schema.quizzes:
+            return {
+                "message": "✅ Không có quiz nào để tạo.",
+                "total": 0,
+                "lesson_id": str(schema.lesson_id),
+            }
 
-        course = await self.db.scalar(
-            select(Courses).where(Courses.id == lesson.course_id)
+        course_id = await self._get_owned_course_id(
+            schema.lesson_id,
+            lecturer_id,
+            "Bạn không có quyền thêm quiz cho khóa học này",
         )
-        if not course or course.instructor_id != lecturer_id:
-            raise HTTPException(403, "Bạn không có quyền thêm quiz cho khóa học này")
-
-        created_quizzes = []
-        now = await to_utc_naive(get_now())
-
-        for quiz_data in schema.quizzes:
-            quiz = LessonQuizzes(
-                id=uuid.uuid4(),
-                lesson_id=schema.lesson_id,
-                course_id=lesson.course_id,
-                question=quiz_data.question.strip(),
-                explanation=quiz_data.explanation or "",
-                difficulty_level=quiz_data.difficulty_level or 1,
-                created_by=schema.created_by,
-                created_at=now,
-            )
-            self.db.add(quiz)
-
-            for i, opt in enumerate(quiz_data.options, start=1):
-                option = LessonQuizOptions(
-                    id=uuid.uuid4(),
-                    quiz_id=quiz.id,
-                    text_=opt.text.strip(),
-                    is_correct=opt.is_correct,
-                    feedback=opt.feedback,
-                    position=opt.position or i,
-                    created_at=now,
-                )
-                self.db.add(option)
-
-            created_quizzes.append(quiz)
 
+        quiz_rows, option_rows = self._build_quiz_rows(
+            schema, course_id, to_utc_naive(get_now())
+        )
+        await self._insert_quiz_rows(quiz_rows, option_rows)
         await self.db.commit()
 
         return {
-            "message": f"✅ Đã tạo {len(created_quizzes)} quiz mới cho bài học.",
-            "total": len(created_quizzes),
+            "message": f"✅ Đã tạo {len(quiz_rows)} quiz mới cho bài học.",
+            "total": len(quiz_rows),
             "lesson_id": str(schema.lesson_id),
         }
 
     async def delete_quiz_video_async(self, quiz_id: uuid.UUID, lecturer_id: uuid.UUID):
         """Xóa 1 quiz theo ID."""
         try:
-            # 1️⃣ Kiểm tra tồn tại
-            existing = await self.db.scalar(
-                select(LessonQuizzes).where(LessonQuizzes.id == quiz_id)
+            # 1️⃣ Xóa kèm điều kiện quyền giảng viên trong 1 câu DELETE
+            deleted = await self.db.scalar(
+                delete(LessonQuizzes)
+                .where(
+                    LessonQuizzes.id == quiz_id,
+                    LessonQuizzes.course_id.in_(
+                        select(Courses.id).where(Courses.instructor_id == lecturer_id)
+                    ),
+                )
+                .returning(LessonQuizzes.id)
             )
-            if not existing:
-                raise HTTPException(404, "❌ Không tìm thấy quiz để xóa.")
-
-            course = await self.db.get(Courses, existing.course_id)
-            if not course or course.instructor_id != lecturer_id:
+            if deleted is None:
+                # 2️⃣ Nhánh hiếm: phân biệt 404 / 403
+                exists = await self.db.scalar(
+                    select(LessonQuizzes.id).where(LessonQuizzes.id == quiz_id)
+                )
+                if not exists:
+                    raise HTTPException(404, "❌ Không tìm thấy quiz để xóa.")
                 raise HTTPException(403, "❌ Bạn không có quyền xóa quiz này.")
-            # 2️⃣ Xóa
-            await self.db.execute(
-                delete(LessonQuizzes).where(LessonQuizzes.id == quiz_id)
-            )
             await self.db.commit()
 
             logger.info(f"🗑️ Đã xóa quiz: {quiz_id}")
@@ -1051,27 +1296,34 @@ class LessonService:
             if course.instructor_id != lecturer_id:
                 raise HTTPException(403, "🚫 Bạn không có quyền truy cập chương này")
 
+            # Đếm chunk bằng COUNT ... GROUP BY, không nạp từng LessonChunks
             stmt = (
-                select(Lessons)
-                .options(selectinload(Lessons.lesson_chunks))
+                select(
+                    Lessons.id,
+                    Lessons.title,
+                    Lessons.lesson_type,
+                    func.count(LessonChunks.id).label("chunk_count"),
+                )
+                .outerjoin(LessonChunks, LessonChunks.lesson_id == Lessons.id)
                 .where(Lessons.section_id == section_id, Lessons.lesson_type == "video")
+                .group_by(Lessons.id)
                 .order_by(Lessons.position.asc())
             )
-            lessons = (await self.db.scalars(stmt)).all()
+            rows = (await self.db.execute(stmt)).all()
 
-            if not lessons:
+            if not rows:
                 raise HTTPException(
                     404, "❌ Không có bài học dạng video trong chương này"
                 )
 
             return [
                 {
-                    "id": str(lesson.id),
-                    "title": lesson.title,
-                    "lesson_type": lesson.lesson_type,
-                    "chunk_count": len(lesson.lesson_chunks or []),
+                    "id": str(row.id),
+                    "title": row.title,
+                    "lesson_type": row.lesson_type,
+                    "chunk_count": row.chunk_count,
                 }
-                for lesson in lessons
+                for row in rows
             ]
 
         except HTTPException:
@@ -1082,10 +1334,22 @@ class LessonService:
                 500, f"⚠️ Có lỗi khi lấy danh sách bài học theo chương: {e}"
             )
 
+    async def _load_languages(self) -> Dict[uuid.UUID, SupportedLanguages]:
+        """Bảng SupportedLanguages (ít thay đổi) cache trong process, TTL 60s."""
+        if (
+            not _LANG_CACHE["by_id"]
+            or time.monotonic() - _LANG_CACHE["ts"] > _LANG_CACHE_TTL
+        ):
+            rows = (await self.db.scalars(select(SupportedLanguages))).all()
+            _LANG_CACHE.update(ts=time.monotonic(), by_id={r.id: r for r in rows})
+        return _LANG_CACHE["by_id"]
+
+    async def _get_lang(self, lang_id: uuid.UUID) -> SupportedLanguages | None:
+        return (await self._load_languages()).get(lang_id)
+
     async def get_code_languages_async(self):
         try:
-            languages = await self.db.scalars(select(SupportedLanguages))
-            return languages.all()
+            return list((await self._load_languages()).values())
         except Exception as e:
             await self.db.rollback()
             raise HTTPException(500, f"⚠️ Có lỗi khi lấy danh sách ngôn ngữ: {e}")
@@ -1095,11 +1359,7 @@ class LessonService:
         Kiểm tra code mẫu có pass toàn bộ testcases không (theo order_index từ 0).
         """
         # 1️⃣ Kiểm tra ngôn ngữ hợp lệ
-        lang = await self.db.scalar(
-            select(SupportedLanguages).where(
-                SupportedLanguages.id == payload.language_id
-            )
-        )
+        lang = await self._get_lang(payload.language_id)
         if not lang:
             raise HTTPException(400, "🚫 Ngôn ngữ không hợp lệ")
 
@@ -1110,14 +1370,21 @@ class LessonService:
         # 3️⃣ Sắp xếp testcases theo order_index (0 → n)
         sorted_testcases = sorted(payload.testcases, key=lambda t: t.order_index or 0)
 
-        # 4️⃣ Duyệt từng testcase
-        for tc in sorted_testcases:
-            result = await self.piston.run_code(
-                language=lang.name,
-                version=lang.version,
-                files=files,
-                stdin=tc.input,
-            )
+        # 4️⃣ Chạy song song các testcase trên Piston (giới hạn bởi semaphore)
+        sem = asyncio.Semaphore(_PISTON_CONCURRENCY)
+
+        async def _run_tc(tc):
+            async with sem:
+                return await self.piston.run_code(
+                    language=lang.name,
+                    version=lang.version,
+                    files=files,
+                    stdin=tc.input,
+                )
+
+        run_results = await asyncio.gather(*(_run_tc(tc) for tc in sorted_testcases))
+
+        for tc, result in zip(sorted_testcases, run_results):
             run = result.get("run", {}) or {}
 
             stdout = (run.get("stdout") or "").strip()
@@ -1162,84 +1429,112 @@ class LessonService:
             "details": results,
         }
 
+    async def _assert_lecturer_owns_lesson(
+        self,
+        lesson_id: uuid.UUID,
+        lecturer_id: uuid.UUID,
+        forbidden_detail: str = "Bạn không có quyền thêm bài code cho khóa học này.",
+    ) -> None:
+        """403 nếu giảng viên không sở hữu khóa học chứa bài học (1 query join có index)."""
+        course_id = await self.db.scalar(
+            select(Courses.id)
+            .join(Lessons, Lessons.course_id == Courses.id)
+            .where(Lessons.id == lesson_id)
+            .where(Courses.instructor_id == lecturer_id)
+        )
+        if not course_id:
+            raise HTTPException(403, forbidden_detail)
+
+    @staticmethod
+    def _build_code_rows(
+        data: LessonCodeCreate, lesson_id: uuid.UUID, now: datetime
+    ) -> Tuple[dict, List[dict], List[dict]]:
+        """
+        Dựng rows (dict) cho lesson_code + files + testcases, không I/O.
+        Gán sẵn created_at/updated_at = now cho cả lô (không dựa vào server default).
+        """
+        lesson_code_id = uuid.uuid4()
+        code_row = {
+            "id": lesson_code_id,
+            "lesson_id": lesson_id,
+            "title": data.title,
+            "description": data.description,
+            "language_id": data.language_id,
+            "difficulty": data.difficulty,
+            "time_limit": data.time_limit,
+            "memory_limit": data.memory_limit,
+            "created_at": now,
+            "updated_at": now,
+        }
+        file_rows = [
+            {
+                "id": uuid.uuid4(),
+                "lesson_code_id": lesson_code_id,
+                "filename": f.filename,
+                "content": f.content,
+                "is_main": f.is_main,
+                "role": role,
+                "is_pass": is_pass,
+                "created_at": now,
+                "updated_at": now,
+            }
+            for files, role, is_pass in (
+                (data.starter_files, "starter", False),
+                (data.solution_files, "solution", True),
+            )
+            for f in files or []
+        ]
+        testcase_rows = [
+            {
+                "id": uuid.uuid4(),
+                "lesson_code_id": lesson_code_id,
+                "input": t.input,
+                "expected_output": t.expected_output,
+                "is_sample": t.is_sample,
+                "order_index": t.order_index,
+                "created_at": now,
+            }
+            for t in data.testcases or []
+        ]
+        return code_row, file_rows, testcase_rows
+
+    async def _insert_code_rows(
+        self,
+        code_rows: List[dict],
+        file_rows: List[dict],
+        testcase_rows: List[dict],
+    ) -> None:
+        """Ghi lesson_codes → files → testcases, mỗi bảng 1 câu INSERT."""
+        if code_rows:
+            await self.db.execute(insert(LessonCodes), code_rows)
+        if file_rows:
+            await self.db.execute(insert(LessonCodeFiles), file_rows)
+        await bulk_insert_rows(self.db, LessonCodeTestcases, testcase_rows)
+
     async def create_full_lesson_code_async(
         self, data: LessonCodeCreate, lecturer_id: uuid.UUID, lesson_id: uuid.UUID
     ):
         """Tạo 1 bài code duy nhất cho 1 lesson"""
         try:
             # ✅ 1️⃣ Kiểm tra quyền giảng viên
-            stmt = (
-                select(Courses.id)
-                .join(Lessons, Lessons.course_id == Courses.id)
-                .where(Lessons.id == lesson_id)
-                .where(Courses.instructor_id == lecturer_id)
-            )
-            course = await self.db.scalar(stmt)
-            if not course:
-                raise HTTPException(
-                    403, "Bạn không có quyền thêm bài code cho khóa học này."
-                )
+            await self._assert_lecturer_owns_lesson(lesson_id, lecturer_id)
 
-            # ✅ 2️⃣ Tạo lesson_code
-            lesson_code_id = uuid.uuid4()
-            await self.db.execute(
-                insert(LessonCodes).values(
-                    id=lesson_code_id,
-                    lesson_id=lesson_id,
-                    title=data.title,
-                    description=data.description,
-                    language_id=data.language_id,
-                    difficulty=data.difficulty,
-                    time_limit=data.time_limit,
-                    memory_limit=data.memory_limit,
-                )
+            # ✅ 2️⃣ Tạo lesson_code + files + testcases
+            code_row, file_rows, testcase_rows = self._build_code_rows(
+                data, lesson_id, to_utc_naive(get_now())
             )
+            # id do DB sinh (uuid_generate_v4) và trả về ngay qua RETURNING
+            code_row.pop("id")
+            lesson_code_id = (
+                await self.db.execute(
+                    insert(LessonCodes).values(code_row).returning(LessonCodes.id)
+                )
+            ).scalar_one()
+            for row in (*file_rows, *testcase_rows):
+                row["lesson_code_id"] = lesson_code_id
+            await self._insert_code_rows([], file_rows, testcase_rows)
 
-            # ✅ 3️⃣ Thêm starter files
-            if data.starter_files:
-                for f in data.starter_files:
-                    await self.db.execute(
-                        insert(LessonCodeFiles).values(
-                            id=uuid.uuid4(),
-                            lesson_code_id=lesson_code_id,
-                            filename=f.filename,
-                            content=f.content,
-                            is_main=f.is_main,
-                            role="starter",
-                            is_pass=False,
-                        )
-                    )
-
-            # ✅ 4️⃣ Thêm solution files
-            if data.solution_files:
-                for f in data.solution_files:
-                    await self.db.execute(
-                        insert(LessonCodeFiles).values(
-                            id=uuid.uuid4(),
-                            lesson_code_id=lesson_code_id,
-                            filename=f.filename,
-                            content=f.content,
-                            is_main=f.is_main,
-                            role="solution",
-                            is_pass=True,
-                        )
-                    )
-
-            # ✅ 5️⃣ Thêm testcases
-            if data.testcases:
-                for t in data.testcases:
-                    await self.db.execute(
-                        insert(LessonCodeTestcases).values(
-                            id=uuid.uuid4(),
-                            lesson_code_id=lesson_code_id,
-                            input=t.input,
-                            expected_output=t.expected_output,
-                            is_sample=t.is_sample,
-                            order_index=t.order_index,
-                        )
-                    )
-
-            # ✅ 6️⃣ Commit toàn bộ transaction
+            # ✅ 3️⃣ Commit toàn bộ transaction
             await self.db.commit()
             logger.info(f"✅ Created lesson_code '{data.title}' for lesson {lesson_id}")
             return lesson_code_id
@@ -1254,18 +1549,44 @@ class LessonService:
     async def create_multiple_lesson_codes_async(
         self, data: List[LessonCodeCreate], lecturer_id: uuid.UUID, lesson_id: uuid.UUID
     ):
-        """Tạo nhiều bài code cho 1 lesson"""
-        created_ids = []
+        """Tạo nhiều bài code cho 1 lesson (1 lần kiểm tra quyền, 1 transaction)"""
+        # Không có bài code nào → không cần chạm DB
+        if not data:
+            return {"status": "success", "created_codes": []}
 
-        for code_data in data:
-            code_id = await self.create_full_lesson_code_async(
-                data=code_data,
-                lecturer_id=lecturer_id,
-                lesson_id=lesson_id,
-            )
-            created_ids.append(str(code_id))
+        try:
+            # 1️⃣ Kiểm tra quyền 1 lần
+            await self._assert_lecturer_owns_lesson(lesson_id, lecturer_id)
+
+            # 2️⃣ Gom rows của tất cả bài code
+            code_rows: List[dict] = []
+            file_rows: List[dict] = []
+            testcase_rows: List[dict] = []
+            now = to_utc_naive(get_now())
+            for code_data in data:
+                code_row, files, testcases = self._build_code_rows(
+                    code_data, lesson_id, now
+                )
+                code_rows.append(code_row)
+                file_rows.extend(files)
+                testcase_rows.extend(testcases)
 
-        return {"status": "success", "created_codes": created_ids}
+            # 3️⃣ Ghi + commit 1 lần
+            await self._insert_code_rows(code_rows, file_rows, testcase_rows)
+            await self.db.commit()
+            logger.info(f"✅ Created {len(code_rows)} lesson_codes for lesson {lesson_id}")
+
+        except HTTPException:
+            raise
+        except Exception as e:
+            await self.db.rollback()
+            logger.error(f"❌ Lỗi tạo lesson_code: {e}")
+            raise HTTPException(500, f"Lỗi khi tạo bài code: {e}")
+
+        return {
+            "status": "success",
+            "created_codes": [str(r["id"]) for r in code_rows],
+        }
 
     async def get_lesson_by_id_async(
         self, lesson_id: uuid.UUID, lecturer_id: uuid.UUID
@@ -1275,23 +1596,13 @@ class LessonService:
         Không xử lý theo lesson_type — tách phần đó ra các hàm riêng.
         """
         try:
-            # 1️⃣ Kiểm tra quyền giảng viên qua join Courses
-            course = await self.db.scalar(
-                select(Courses)
-                .join(Lessons, Lessons.course_id == Courses.id)
-                .where(Lessons.id == lesson_id)
-            )
-
-            if not course:
-                raise HTTPException(404, "Không tìm thấy khóa học chứa bài học này")
-            if course.instructor_id != lecturer_id:
+            # 1️⃣ Kiểm tra quyền giảng viên
+            if not await self._authorize_lesson(lesson_id, lecturer_id):
                 raise HTTPException(403, "Bạn không có quyền truy cập bài học này")
 
-            # 2️⃣ Lấy thông tin bài học + preload section để hiển thị
+            # 2️⃣ Lấy thông tin bài học
             lesson: Lessons | None = await self.db.scalar(
-                select(Lessons)
-                .options(selectinload(Lessons.section))
-                .where(Lessons.id == lesson_id)
+                select(Lessons).where(Lessons.id == lesson_id)
             )
             if not lesson:
                 raise HTTPException(404, "Không tìm thấy bài học")
@@ -1321,76 +1632,92 @@ class LessonService:
     ):
         """✏️ Cập nhật (ghi đè) toàn bộ quiz của một bài học."""
         try:
-            # 1️⃣ Kiểm tra bài học tồn tại
-            lesson = await self.db.scalar(
-                select(Lessons).where(Lessons.id == schema.lesson_id)
+            # 1️⃣ + 2️⃣ Kiểm tra bài học tồn tại + quyền giảng viên (1 query)
+            course_id = await self._get_owned_course_id(
+                schema.lesson_id,
+                lecturer_id,
+                "Bạn không có quyền cập nhật quiz cho khóa học này",
             )
-            if not lesson:
-                raise HTTPException(404, "Không tìm thấy bài học")
 
-            # 2️⃣ Kiểm tra quyền giảng viên
-            course = await self.db.scalar(
-                select(Courses).where(Courses.id == lesson.course_id)
+            # 3️⃣ Lấy id quiz/option hiện có của bài học (để giữ id ổn định)
+            old_quiz_ids = set(
+                await self.db.scalars(
+                    select(LessonQuizzes.id).where(
+                        LessonQuizzes.lesson_id == schema.lesson_id
+                    )
+                )
             )
-            if not course or course.instructor_id != lecturer_id:
-                raise HTTPException(
-                    403, "Bạn không có quyền cập nhật quiz cho khóa học này"
+            old_option_ids = (
+                set(
+                    await self.db.scalars(
+                        select(LessonQuizOptions.id).where(
+                            LessonQuizOptions.quiz_id.in_(old_quiz_ids)
+                        )
+                    )
                 )
+                if old_quiz_ids
+                else set()
+            )
 
-            # 3️⃣ Xóa toàn bộ quiz và options cũ
-            old_quiz_ids = await self.db.scalars(
-                select(LessonQuizzes.id).where(
-                    LessonQuizzes.lesson_id == schema.lesson_id
+            quiz_rows, option_rows = self._build_quiz_rows(
+                schema,
+                course_id,
+                to_utc_naive(get_now()),
+                known_quiz_ids=old_quiz_ids,
+                known_option_ids=old_option_ids,
+            )
+            keep_quiz_ids = [r["id"] for r in quiz_rows]
+            keep_option_ids = [r["id"] for r in option_rows]
+
+            # 4️⃣ Xóa quiz không còn trong payload (options tự xóa do ON DELETE CASCADE)
+            await self.db.execute(
+                delete(LessonQuizzes).where(
+                    LessonQuizzes.lesson_id == schema.lesson_id,
+                    LessonQuizzes.id.notin_(keep_quiz_ids),
                 )
             )
-            old_quiz_ids = list(old_quiz_ids)
-            if old_quiz_ids:
+
+            # 5️⃣ Upsert quiz + options theo id
+            if quiz_rows:
+                stmt = pg_insert(LessonQuizzes).values(quiz_rows)
                 await self.db.execute(
-                    delete(LessonQuizOptions).where(
-                        LessonQuizOptions.quiz_id.in_(old_quiz_ids)
+                    stmt.on_conflict_do_update(
+                        index_elements=[LessonQuizzes.id],
+                        set_={
+                            "question": stmt.excluded.question,
+                            "explanation": stmt.excluded.explanation,
+                            "difficulty_level": stmt.excluded.difficulty_level,
+                        },
                     )
                 )
+            if option_rows:
+                stmt = pg_insert(LessonQuizOptions).values(option_rows)
                 await self.db.execute(
-                    delete(LessonQuizzes).where(LessonQuizzes.id.in_(old_quiz_ids))
+                    stmt.on_conflict_do_update(
+                        index_elements=[LessonQuizOptions.id],
+                        set_={
+                            "quiz_id": stmt.excluded.quiz_id,
+                            "text": stmt.excluded.text,
+                            "is_correct": stmt.excluded.is_correct,
+                            "feedback": stmt.excluded.feedback,
+                            "position": stmt.excluded.position,
+                        },
+                    )
                 )
-                await self.db.commit()
 
-            # 4️⃣ Tạo mới toàn bộ quiz
-            now = await to_utc_naive(get_now())
-            created_quizzes = []
-
-            for quiz_data in schema.quizzes:
-                quiz = LessonQuizzes(
-                    id=uuid.uuid4(),
-                    lesson_id=schema.lesson_id,
-                    course_id=lesson.course_id,
-                    question=quiz_data.question.strip(),
-                    explanation=quiz_data.explanation or "",
-                    difficulty_level=quiz_data.difficulty_level or 1,
-                    created_by=schema.created_by,
-                    created_at=now,
-                )
-                self.db.add(quiz)
-
-                for i, opt in enumerate(quiz_data.options, start=1):
-                    option = LessonQuizOptions(
-                        id=uuid.uuid4(),
-                        quiz_id=quiz.id,
-                        text_=opt.text.strip(),
-                        is_correct=opt.is_correct,
-                        feedback=opt.feedback,
-                        position=opt.position or i,
-                        created_at=now,
+            # 6️⃣ Xóa options bị bỏ khỏi các quiz được giữ lại
+            if keep_quiz_ids:
+                await self.db.execute(
+                    delete(LessonQuizOptions).where(
+                        LessonQuizOptions.quiz_id.in_(keep_quiz_ids),
+                        LessonQuizOptions.id.notin_(keep_option_ids),
                     )
-                    self.db.add(option)
-
-                created_quizzes.append(quiz)
-
+                )
             await self.db.commit()
 
             return {
-                "message": f"✅ Đã cập nhật {len(created_quizzes)} quiz mới cho bài học.",
-                "total": len(created_quizzes),
+                "message": f"✅ Đã cập nhật {len(quiz_rows)} quiz mới cho bài học.",
+                "total": len(quiz_rows),
                 "lesson_id": str(schema.lesson_id),
             }
 
@@ -1414,36 +1741,19 @@ class LessonService:
         """
 
         try:
-            # 1️⃣ Lấy lesson + course
-            lesson = await self.db.scalar(
-                select(Lessons)
-                .options(
-                    selectinload(Lessons.section).selectinload(CourseSections.course),
-                )
-                .where(Lessons.id == lesson_id)
-            )
-            if not lesson:
-                raise HTTPException(404, "❌ Không tồn tại bài học")
-
-            course = lesson.section.course if lesson.section else None
-            if not course:
-                raise HTTPException(404, "❌ Không tìm thấy khóa học của bài học này")
-
-            # 2️⃣ Nếu yêu cầu kiểm tra quyền chỉnh sửa
-            if check_permission:
-                if not requester_id or course.instructor_id != requester_id:
-                    raise HTTPException(
-                        403, "🚫 Bạn không có quyền chỉnh sửa bài học này"
-                    )
+            # 1️⃣ Kiểm tra bài học tồn tại (+ quyền chỉnh sửa nếu cần)
+            is_owner = await self._authorize_lesson(lesson_id, requester_id)
+            if check_permission and not is_owner:
+                raise HTTPException(403, "🚫 Bạn không có quyền chỉnh sửa bài học này")
 
-            # 3️⃣ Lấy video
+            # 2️⃣ Lấy video
             video = await self.db.scalar(
                 select(LessonVideos).where(LessonVideos.lesson_id == lesson_id)
             )
             if not video:
                 raise HTTPException(404, "Bài học chưa có video")
 
-            # 4️⃣ Chuẩn hóa dữ liệu trả về
+            # 3️⃣ Chuẩn hóa dữ liệu trả về
             return {
                 "video_url": video.video_url,
                 "file_id": video.file_id,
@@ -1473,20 +1783,8 @@ class LessonService:
         """
 
         try:
-            # 1️⃣ Lấy bài học và kiểm tra quyền
-            lesson = await self.db.scalar(
-                select(Lessons)
-                .options(
-                    selectinload(Lessons.section).selectinload(CourseSections.course)
-                )
-                .where(Lessons.id == lesson_id)
-            )
-
-            if not lesson:
-                raise HTTPException(404, "❌ Không tìm thấy bài học")
-
-            course = lesson.section.course if lesson.section else None
-            if not course or course.instructor_id != lecturer.id:
+            # 1️⃣ Kiểm tra quyền
+            if not await self._authorize_lesson(lesson_id, lecturer.id):
                 raise HTTPException(403, "🚫 Bạn không có quyền sửa bài học này")
 
             # 2️⃣ Lấy dữ liệu cần update
@@ -1527,29 +1825,13 @@ class LessonService:
         """
         try:
             # 1️⃣ Kiểm tra quyền
-            lesson = await self.db.scalar(
-                select(Lessons)
-                .options(
-                    selectinload(Lessons.section).selectinload(CourseSections.course)
-                )
-                .where(Lessons.id == lesson_id)
-            )
-            if not lesson:
-                raise HTTPException(404, "Không tìm thấy bài học")
-
-            course = lesson.section.course if lesson.section else None
-            if not course or course.instructor_id != lecturer_id:
+            if not await self._authorize_lesson(lesson_id, lecturer_id):
                 raise HTTPException(403, "Bạn không có quyền thay đổi video này")
 
-            # 2️⃣ Xóa video cũ (bên ngoài transaction)
-            old_video = await self.db.scalar(
-                select(LessonVideos).where(LessonVideos.lesson_id == lesson_id)
+            # 2️⃣ Xóa video cũ (chưa commit, commit 1 lần ở cuối)
+            await self.db.execute(
+                delete(LessonVideos).where(LessonVideos.lesson_id == lesson_id)
             )
-            if old_video:
-                await self.db.execute(
-                    delete(LessonVideos).where(LessonVideos.lesson_id == lesson_id)
-                )
-                await self.db.commit()
 
             # 3️⃣ Gọi lại hàm upload phù hợp
             if video:
@@ -1565,10 +1847,14 @@ class LessonService:
                     lecturer_id=lecturer_id,
                     schema=schema,
                     background_tasks=background_tasks,
+                    defer_commit=True,
                 )
             else:
                 raise HTTPException(400, "Thiếu dữ liệu video để thay thế")
 
+            # 4️⃣ Commit 1 lần: xóa video cũ + video mới
+            await self.db.commit()
+
             return {
                 "message": "✅ Video đã được thay thế thành công",
                 "lesson_id": str(lesson_id),
@@ -1581,14 +1867,19 @@ class LessonService:
             await self.db.rollback()  # rollback nếu bước giữa fail
             raise HTTPException(500, f"❌ Lỗi khi thay thế video bài học: {e}")
 
-    async def test(self, video_id: str):
+    async def test(self, video_id: str, background_tasks: BackgroundTasks):
+        """Xếp hàng trích ngữ cảnh video chạy nền, trả về ngay."""
+        background_tasks.add_task(LessonService._extract_video_context_task, video_id)
+        return {"status": "queued", "video_id": video_id}
+
+    @staticmethod
+    async def _extract_video_context_task(video_id: str):
         try:
-            transcript_service = YoutubeTranscriptService()
+            transcript_service = get_transcript_service()
             description = await transcript_service.extract_video_context(video_id)
-            print("🧠 Gemini mô tả:", description[:200], "...")
-            return {"description": description}
+            logger.info(f"🧠 Gemini mô tả [{video_id}]: {description[:200]} ...")
         except Exception as e:
-            raise e
+            logger.exception(f"❌ Lỗi trích ngữ cảnh video {video_id}: {e}")
 
     async def get_all_lesson_codes_async(
         self, lesson_id: uuid.UUID, lecturer_id: uuid.UUID
@@ -1603,90 +1894,121 @@ class LessonService:
           - Testcases
         """
         try:
-            # ✅ 1️⃣ Kiểm tra quyền giảng viên
-            check_stmt = (
-                select(Courses.id)
-                .join(Lessons, Lessons.course_id == Courses.id)
+            # ✅ 1️⃣ + 2️⃣ Truy vấn lesson_code thuộc lesson_id (chỉ lấy cột cần, không hydrate ORM),
+            # điều kiện quyền giảng viên gộp vào WHERE bằng EXISTS
+            owned = (
+                exists()
                 .where(Lessons.id == lesson_id)
+                .where(Courses.id == Lessons.course_id)
                 .where(Courses.instructor_id == lecturer_id)
             )
-            owned_course = await self.db.scalar(check_stmt)
-            if not owned_course:
-                raise HTTPException(
-                    403, "❌ Bạn không có quyền xem bài code của khóa học này."
+            code_rows = (
+                await self.db.execute(
+                    select(
+                        LessonCodes.id,
+                        LessonCodes.lesson_id,
+                        LessonCodes.title,
+                        LessonCodes.description,
+                        LessonCodes.difficulty,
+                        SupportedLanguages.name.label("language"),
+                        LessonCodes.time_limit,
+                        LessonCodes.memory_limit,
+                    )
+                    .outerjoin(
+                        SupportedLanguages,
+                        SupportedLanguages.id == LessonCodes.language_id,
+                    )
+                    .where(LessonCodes.lesson_id == lesson_id, owned)
+                    .order_by(LessonCodes.created_at.desc())
                 )
+            ).all()
 
-            # ✅ 2️⃣ Truy vấn tất cả lesson_code thuộc lesson_id đó
-            stmt = (
-                select(LessonCodes)
-                .options(
-                    selectinload(LessonCodes.lesson_code_files),
-                    selectinload(LessonCodes.lesson_code_testcases),
-                    selectinload(LessonCodes.language),
-                )
-                .where(LessonCodes.lesson_id == lesson_id)
-                .order_by(LessonCodes.created_at.desc())
-            )
+            if not code_rows:
+                # Rỗng: probe thêm 1 lần để phân biệt 403 / chưa có bài code
+                if not await self.db.scalar(select(owned)):
+                    raise HTTPException(
+                        403, "❌ Bạn không có quyền xem bài code của khóa học này."
+                    )
+                raise HTTPException(404, "Bài học này chưa có bài code nào.")
 
-            results = await self.db.scalars(stmt)
-            lesson_codes: List[LessonCodes] = results.all()
+            code_ids = [r.id for r in code_rows]
 
-            if not lesson_codes:
-                raise HTTPException(404, "Bài học này chưa có bài code nào.")
+            # ✅ 3️⃣ Files + testcases của tất cả bài code (mỗi bảng 1 query)
+            file_rows = (
+                await self.db.execute(
+                    select(
+                        LessonCodeFiles.id,
+                        LessonCodeFiles.lesson_code_id,
+                        LessonCodeFiles.filename,
+                        LessonCodeFiles.content,
+                        LessonCodeFiles.is_main,
+                        LessonCodeFiles.role,
+                        LessonCodeFiles.is_pass,
+                    ).where(
+                        LessonCodeFiles.lesson_code_id.in_(code_ids),
+                        LessonCodeFiles.role.in_(("starter", "solution")),
+                    )
+                )
+            ).all()
+            testcase_rows = (
+                await self.db.execute(
+                    select(
+                        LessonCodeTestcases.id,
+                        LessonCodeTestcases.lesson_code_id,
+                        LessonCodeTestcases.input,
+                        LessonCodeTestcases.expected_output,
+                        LessonCodeTestcases.is_sample,
+                        LessonCodeTestcases.order_index,
+                    )
+                    .where(LessonCodeTestcases.lesson_code_id.in_(code_ids))
+                    .order_by(LessonCodeTestcases.order_index.asc().nulls_first())
+                )
+            ).all()
 
-            # ✅ 3️⃣ Trả về danh sách chi tiết từng bài code
-            data_list = []
-            for lc in lesson_codes:
-                data_list.append(
+            # ✅ 4️⃣ Gom 1 lượt theo (lesson_code_id, role) / lesson_code_id
+            # UUID giữ nguyên kiểu, encoder của FastAPI/orjson tự serialize thành chuỗi
+            files_by_key: Dict[Tuple[uuid.UUID, str], List[dict]] = {}
+            for f in file_rows:
+                files_by_key.setdefault((f.lesson_code_id, f.role), []).append(
                     {
-                        "id": str(lc.id),
-                        "lesson_id": str(lc.lesson_id),
-                        "title": lc.title,
-                        "description": lc.description,
-                        "difficulty": lc.difficulty,
-                        "language": lc.language.name if lc.language else None,
-                        "time_limit": lc.time_limit,
-                        "memory_limit": lc.memory_limit,
-                        "starter_files": [
-                            {
-                                "id": str(f.id),
-                                "filename": f.filename,
-                                "content": f.content,
-                                "is_main": f.is_main,
-                                "role": f.role,
-                                "is_pass": f.is_pass,
-                            }
-                            for f in lc.lesson_code_files
-                            if f.role == "starter"
-                        ],
-                        "solution_files": [
-                            {
-                                "id": str(f.id),
-                                "filename": f.filename,
-                                "content": f.content,
-                                "is_main": f.is_main,
-                                "role": f.role,
-                                "is_pass": f.is_pass,
-                            }
-                            for f in lc.lesson_code_files
-                            if f.role == "solution"
-                        ],
-                        "testcases": [
-                            {
-                                "id": str(t.id),
-                                "input": t.input,
-                                "expected_output": t.expected_output,
-                                "is_sample": t.is_sample,
-                                "order_index": t.order_index,
-                            }
-                            for t in sorted(
-                                lc.lesson_code_testcases,
-                                key=lambda x: x.order_index or 0,
-                            )
-                        ],
+                        "id": f.id,
+                        "filename": f.filename,
+                        "content": f.content,
+                        "is_main": f.is_main,
+                        "role": f.role,
+                        "is_pass": f.is_pass,
+                    }
+                )
+
+            tests_by_code: Dict[uuid.UUID, List[dict]] = {}
+            for t in testcase_rows:
+                tests_by_code.setdefault(t.lesson_code_id, []).append(
+                    {
+                        "id": t.id,
+                        "input": t.input,
+                        "expected_output": t.expected_output,
+                        "is_sample": t.is_sample,
+                        "order_index": t.order_index,
                     }
                 )
 
+            data_list = [
+                {
+                    "id": r.id,
+                    "lesson_id": r.lesson_id,
+                    "title": r.title,
+                    "description": r.description,
+                    "difficulty": r.difficulty,
+                    "language": r.language,
+                    "time_limit": r.time_limit,
+                    "memory_limit": r.memory_limit,
+                    "starter_files": files_by_key.get((r.id, "starter"), []),
+                    "solution_files": files_by_key.get((r.id, "solution"), []),
+                    "testcases": tests_by_code.get(r.id, []),
+                }
+                for r in code_rows
+            ]
+
             logger.info(
                 f"📚 Giảng viên {lecturer_id} lấy {len(data_list)} bài code thuộc lesson {lesson_id}"
             )
@@ -1711,79 +2033,101 @@ class LessonService:
         - Không id hoặc type=create -> tạo mới
         """
 
+        now = get_now()  # 1 mốc thời gian cho cả batch
         try:
-            # 1️⃣ Kiểm tra quyền giảng viên
-            q_check = (
-                select(Courses.id)
-                .join(Lessons, Lessons.course_id == Courses.id)
-                .where(Lessons.id == lesson_id)
-                .where(Courses.instructor_id == lecturer_id)
+            # 1️⃣ Kiểm tra quyền giảng viên (có cache TTL ngắn)
+            await self._assert_lecturer_owns_lesson(
+                lesson_id, lecturer_id, "❌ Bạn không có quyền sửa bài học này."
             )
-            owned = await self.db.scalar(q_check)
-            if not owned:
-                raise HTTPException(403, "❌ Bạn không có quyền sửa bài học này.")
 
             # 2️⃣ Lấy toàn bộ code hiện có
             q_codes = select(LessonCodes).where(LessonCodes.lesson_id == lesson_id)
             result = await self.db.scalars(q_codes)
             existing_codes = {lc.id: lc for lc in result.all()}
 
-            # 3️⃣ Duyệt danh sách cập nhật
-            for u in updates:
-                lc = existing_codes.get(u.lesson_code_id) if u.lesson_code_id else None
-
-                # --- ❌ XÓA: con trước, cha sau (tránh lỗi NULL constraint)
-                if u.type == "delete" and lc:
-                    await self.db.execute(
-                        delete(LessonCodeFiles).where(
-                            LessonCodeFiles.lesson_code_id == lc.id
-                        )
+            # Prefetch files + testcases của các code hiện có (mỗi bảng 1 query)
+            files_by_code: Dict[uuid.UUID, Dict[str, LessonCodeFiles]] = {}
+            tests_by_code: Dict[uuid.UUID, Dict[str, LessonCodeTestcases]] = {}
+            if existing_codes:
+                for f in await self.db.scalars(
+                    select(LessonCodeFiles).where(
+                        LessonCodeFiles.lesson_code_id.in_(existing_codes.keys())
                     )
-                    await self.db.execute(
-                        delete(LessonCodeTestcases).where(
-                            LessonCodeTestcases.lesson_code_id == lc.id
-                        )
+                ):
+                    files_by_code.setdefault(f.lesson_code_id, {})[str(f.id)] = f
+                for t in await self.db.scalars(
+                    select(LessonCodeTestcases).where(
+                        LessonCodeTestcases.lesson_code_id.in_(existing_codes.keys())
                     )
-                    await self.db.delete(lc)
-                    logger.info(f"🗑️ Đã xóa bài code {lc.id}")
+                ):
+                    tests_by_code.setdefault(t.lesson_code_id, {})[str(t.id)] = t
+
+            # 3️⃣ ❌ XÓA gom 1 câu DELETE (files/testcases tự xóa do ON DELETE CASCADE)
+            delete_ids = [
+                u.lesson_code_id
+                for u in updates
+                if u.type == "delete" and u.lesson_code_id in existing_codes
+            ]
+            if delete_ids:
+                await self.db.execute(
+                    delete(LessonCodes).where(LessonCodes.id.in_(delete_ids))
+                )
+                logger.info(f"🗑️ Đã xóa {len(delete_ids)} bài code: {delete_ids}")
+
+            # 4️⃣ Duyệt danh sách tạo mới / cập nhật
+            # Code/file/testcase mới gom lại, ghi 1 lần sau vòng lặp (id sinh phía client)
+            new_code_rows: List[dict] = []
+            new_file_rows: List[dict] = []
+            new_test_rows: List[dict] = []
+            for u in updates:
+                if u.type == "delete":
                     continue
+                lc = existing_codes.get(u.lesson_code_id) if u.lesson_code_id else None
 
                 # --- 🆕 TẠO MỚI
                 if not lc:
-                    lc = LessonCodes(
-                        id=uuid.uuid4(),
-                        lesson_id=lesson_id,
-                        title=u.title,
-                        description=u.description,
-                        difficulty=u.difficulty,
-                        language_id=u.language_id,
-                        time_limit=u.time_limit,
-                        memory_limit=u.memory_limit,
-                        created_at=get_now(),
-                        updated_at=get_now(),
+                    code_id = uuid.uuid4()
+                    new_code_rows.append(
+                        {
+                            "id": code_id,
+                            "lesson_id": lesson_id,
+                            "title": u.title,
+                            "description": u.description,
+                            "difficulty": u.difficulty,
+                            "language_id": u.language_id,
+                            "time_limit": u.time_limit,
+                            "memory_limit": u.memory_limit,
+                            "created_at": now,
+                            "updated_at": now,
+                        }
                     )
-                    self.db.add(lc)
-                    await self.db.flush()
-                    logger.info(f"🆕 Tạo bài code mới {lc.id}")
+                    logger.info(f"🆕 Tạo bài code mới {code_id}")
 
-                # --- ✏️ CẬP NHẬT
+                # --- ✏️ CẬP NHẬT: chỉ ghi các cột thực sự đổi, không đổi gì thì bỏ qua UPDATE
                 else:
-                    lc.title = u.title or lc.title
-                    lc.description = u.description or lc.description
-                    lc.difficulty = u.difficulty or lc.difficulty
-                    lc.language_id = u.language_id or lc.language_id
-                    lc.time_limit = u.time_limit or lc.time_limit
-                    lc.memory_limit = u.memory_limit or lc.memory_limit
-                    lc.updated_at = get_now()
-                    await self.db.flush()
-
-                # 4️⃣ FILES
-                q_files = await self.db.scalars(
-                    select(LessonCodeFiles).where(
-                        LessonCodeFiles.lesson_code_id == lc.id
-                    )
-                )
-                files_map = {str(f.id): f for f in q_files.all()}
+                    changes = {
+                        k: v
+                        for k, v in (
+                            ("title", u.title),
+                            ("description", u.description),
+                            ("difficulty", u.difficulty),
+                            ("language_id", u.language_id),
+                            ("time_limit", u.time_limit),
+                            ("memory_limit", u.memory_limit),
+                        )
+                        if v and getattr(lc, k) != v
+                    }
+                    code_id = lc.id
+                    if changes:
+                        await self.db.execute(
+                            update(LessonCodes)
+                            .where(LessonCodes.id == lc.id)
+                            .values(**changes, updated_at=now)
+                            .execution_options(synchronize_session=False)
+                        )
+
+                # 5️⃣ FILES
+                files_map = files_by_code.get(code_id, {})
 
                 for f in u.files or []:
                     fid = str(f.id) if f.id else None
@@ -1802,33 +2146,27 @@ class LessonService:
                         file_obj.is_main = (
                             f.is_main if f.is_main is not None else file_obj.is_main
                         )
-                        file_obj.updated_at = get_now()
+                        file_obj.updated_at = now
                         continue
 
                     # 🆕 Thêm file mới
                     if not fid or f.type == "create":
-                        new_file = LessonCodeFiles(
-                            id=uuid.uuid4(),
-                            lesson_code_id=lc.id,
-                            filename=f.filename,
-                            content=f.content,
-                            role=f.role,
-                            is_main=f.is_main or False,
-                            is_pass=(f.role == "starter"),
-                            created_at=get_now(),
-                            updated_at=get_now(),
+                        new_file_rows.append(
+                            {
+                                "id": uuid.uuid4(),
+                                "lesson_code_id": code_id,
+                                "filename": f.filename,
+                                "content": f.content,
+                                "role": f.role,
+                                "is_main": f.is_main or False,
+                                "is_pass": f.role == "starter",
+                                "created_at": now,
+                                "updated_at": now,
+                            }
                         )
-                        self.db.add(new_file)
-
-                await self.db.flush()
 
-                # 5️⃣ TESTCASES
-                q_tests = await self.db.scalars(
-                    select(LessonCodeTestcases).where(
-                        LessonCodeTestcases.lesson_code_id == lc.id
-                    )
-                )
-                tests_map = {str(t.id): t for t in q_tests.all()}
+                # 6️⃣ TESTCASES
+                tests_map = tests_by_code.get(code_id, {})
 
                 for t in u.testcases or []:
                     tid = str(t.id) if t.id else None
@@ -1855,20 +2193,24 @@ class LessonService:
 
                     # 🆕 Thêm test mới
                     if not tid or t.type == "create":
-                        new_test = LessonCodeTestcases(
-                            id=uuid.uuid4(),
-                            lesson_code_id=lc.id,
-                            input=t.input,
-                            expected_output=t.expected_output,
-                            is_sample=t.is_sample or False,
-                            order_index=t.order_index or 0,
-                            created_at=get_now(),
+                        new_test_rows.append(
+                            {
+                                "id": uuid.uuid4(),
+                                "lesson_code_id": code_id,
+                                "input": t.input,
+                                "expected_output": t.expected_output,
+                                "is_sample": t.is_sample or False,
+                                "order_index": t.order_index or 0,
+                                "created_at": now,
+                            }
                         )
-                        self.db.add(new_test)
 
-                await self.db.flush()
+            # Flush 1 lần các sửa/xóa file, testcase đang chờ trong session,
+            # rồi ghi code/file/testcase mới: mỗi bảng 1 câu INSERT
+            await self.db.flush()
+            await self._insert_code_rows(new_code_rows, new_file_rows, new_test_rows)
 
-            # ✅ 6️⃣ Commit toàn bộ
+            # ✅ 7️⃣ Commit toàn bộ
             await self.db.commit()
             logger.info(
                 f"✅ Đã xử lý {len(updates)} bài code trong bài học {lesson_id}"
@@ -1882,36 +2224,12 @@ class LessonService:
             logger.error(f"❌ Lỗi khi cập nhật bài code: {e}")
             raise HTTPException(500, f"Lỗi khi cập nhật bài code: {e}")
 
-    @staticmethod
-    async def _process_embedding_background(note_id: uuid.UUID):
-
-        async with AsyncSessionLocal() as db:
-            try:
-                note = await db.scalar(
-                    select(LessonNotes).where(LessonNotes.id == note_id)
-                )
-                if not note or not note.content.strip():
-                    return
-
-                embedding_service = await get_embedding_service()
-                vector = await embedding_service.embed_google_normalized(note.content)
-
-                note.embedding = vector
-                note.created_at = get_now()
-                await db.commit()
-
-                print(f"✅ Đã nhúng embedding cho note {note_id}")
-            except Exception as e:
-                await db.rollback()
-                print(f"❌ Lỗi khi nhúng embedding note {note_id}: {e}")
-
     async def create_note_async(
         self,
         lesson_id: uuid.UUID,
         user_id: uuid.UUID,
         time_seconds: int,
         content: str,
-        background_tasks: BackgroundTasks,
     ):
         try:
             lesson = await self.db.scalar(
@@ -1934,10 +2252,8 @@ class LessonService:
             await self.db.commit()
             await self.db.refresh(new_note)
 
-            # 3️⃣ Gọi nền nhúng embedding (async)
-            background_tasks.add_task(
-                LessonService._process_embedding_background, new_note.id
-            )
+            # 3️⃣ Đẩy vào hàng đợi embedding nền (worker gom lô)
+            enqueue_note_embedding(new_note.id)
 
             return {
                 "message": "Tạo ghi chú thành công",
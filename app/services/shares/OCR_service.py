@@ -1,15 +1,156 @@
 from __future__ import annotations
 
+import asyncio
+import importlib.util
 import re
+import threading
 from io import BytesIO
 from pathlib import Path
-from typing import List, Union, cast
+from typing import Any, Dict, List, Tuple, Union, cast
 
 import easyocr
 import fitz  # PyMuPDF
 import httpx
+import numpy as np
 from loguru import logger
-from PIL import Image
+
+from app.core.settings import settings
+
+# HTTP client đồng bộ dùng chung (thread-safe) để tải PDF/ảnh: giữ kết nối keep-alive + TLS
+_DOWNLOAD_CHUNK_SIZE = 256 * 1024
+_http_client: httpx.Client | None = None
+_http_client_lock = threading.Lock()
+
+
+def _get_http_client() -> httpx.Client:
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(max_keepalive_connections=20),
+                )
+    return _http_client
+
+
+def close_ocr_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        _http_client.close()
+        _http_client = None
+
+
+def _download_bytes(url: str, timeout: float) -> bytes:
+    """Tải file theo chunk 256KB vào 1 bytearray (không giữ list các mẩu bytes nhỏ)."""
+    buf = bytearray()
+    with _get_http_client().stream("GET", url, timeout=timeout) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_bytes(chunk_size=_DOWNLOAD_CHUNK_SIZE):
+            buf.extend(chunk)
+    return bytes(buf)
+
+
+def _resolve_ocr_use_gpu() -> bool:
+    """EASYOCR_DEVICE=cuda|cpu ép thiết bị; mặc định auto → dùng CUDA nếu torch thấy GPU."""
+    device = settings.EASYOCR_DEVICE.strip().lower()
+    if device in ("cpu", "false", "0"):
+        return False
+    try:
+        import torch
+
+        available = torch.cuda.is_available()
+    except Exception:
+        available = False
+    if device in ("cuda", "gpu", "true", "1") and not available:
+        logger.warning("⚠️ EASYOCR_DEVICE=cuda nhưng không tìm thấy CUDA, dùng CPU.")
+    return available
+
+
+class _OpenVINOModule:
+    """
+    Thay module torch (detector / recognizer của EasyOCR) bằng model OpenVINO đã compile cho CPU.
+    Nhận/trả torch.Tensor như module gốc; mỗi lần gọi tạo infer request riêng (an toàn đa luồng).
+    """
+
+    def __init__(self, compiled: Any):
+        self._compiled = compiled
+        self._n_inputs = len(compiled.inputs)
+        self._n_outputs = len(compiled.outputs)
+
+    def __call__(self, *args: Any) -> Any:
+        import torch
+
+        request = self._compiled.create_infer_request()
+        # Input không dùng trong forward (vd `text` của recognizer CTC) có thể bị lược khi convert
+        request.infer([a.detach().cpu().numpy() for a in args[: self._n_inputs]])
+        outputs = [
+            torch.from_numpy(request.get_output_tensor(i).data.copy())
+            for i in range(self._n_outputs)
+        ]
+        return outputs[0] if self._n_outputs == 1 else tuple(outputs)
+
+    def eval(self) -> "_OpenVINOModule":
+        return self
+
+
+def _compile_openvino(
+    name: str,
+    module: Any,
+    example_input: tuple,
+    shapes: list,
+    int8_weights: bool = False,
+) -> Any:
+    """
+    Convert + compile 1 module sang OpenVINO; lỗi thì giữ nguyên module PyTorch.
+    int8_weights: nén trọng số INT8 bằng NNCF (nếu cài) → dùng VNNI trên CPU Intel.
+    """
+    try:
+        import openvino as ov
+        import torch
+
+        with torch.no_grad():
+            ov_model = ov.convert_model(
+                getattr(module, "module", module),  # bỏ lớp DataParallel nếu có
+                example_input=example_input,
+                input=shapes,
+            )
+        if int8_weights and importlib.util.find_spec("nncf") is not None:
+            import nncf
+
+            ov_model = nncf.compress_weights(ov_model)
+            logger.info(f"⚡ EasyOCR {name}: trọng số INT8 (NNCF)")
+        compiled = ov.Core().compile_model(ov_model, "CPU")
+        logger.info(f"⚡ EasyOCR {name} chạy bằng OpenVINO (CPU)")
+        return _OpenVINOModule(compiled)
+    except Exception as e:
+        logger.warning(f"⚠️ Không chuyển được {name} sang OpenVINO, dùng PyTorch: {e}")
+        return module
+
+
+def _compile_tensorrt(name: str, module: Any, inputs: list) -> Any:
+    """Compile 1 module sang engine TensorRT (FP16) qua torch-tensorrt; lỗi thì giữ PyTorch."""
+    try:
+        import torch
+        import torch_tensorrt
+
+        base = getattr(module, "module", module)  # bỏ lớp DataParallel của EasyOCR
+        compiled = torch_tensorrt.compile(
+            base.eval(),
+            ir="dynamo",
+            inputs=inputs,
+            enabled_precisions={torch.float16},
+        )
+        logger.info(f"⚡ EasyOCR {name} chạy bằng TensorRT (FP16)")
+        return compiled
+    except Exception as e:
+        logger.warning(f"⚠️ Không build được TensorRT cho {name}, dùng PyTorch: {e}")
+        return module
+
+
+# Nhận diện resource_type từ content_type: 1 lượt quét regex thay vì nhiều phép `in`
+_MIME_RE = re.compile(r"pdf|image|text|plain|json|video|audio")
+_MIME_ALIASES = {"plain": "text"}
 
 
 class OCRService:
@@ -19,55 +160,215 @@ class OCRService:
     - EasyOCR chỉ được load 1 lần (singleton).
     """
 
-    def __init__(self):
-        logger.info("⚙️ Khởi tạo EasyOCR reader (vi)...")
-        self.reader = easyocr.Reader(["vi"], gpu=False)
+    # Số trang tối đa gom vào 1 lần readtext_batched (giới hạn RAM giữ ảnh trang)
+    PAGE_BATCH_SIZE = 8
+    # Số vùng text recognizer xử lý mỗi forward
+    RECOG_BATCH_SIZE = 8
+    # DPI raster: trang khổ lớn (vượt ngưỡng px ở DPI mặc định) hạ xuống DPI thấp hơn
+    PAGE_DPI = 200
+    LARGE_PAGE_DPI = 150
+    LARGE_PAGE_MAX_PX = 2000
+    # Trần bộ nhớ store của MuPDF (font/ảnh đã decode) trong lúc raster
+    FITZ_STORE_CAP = 256 * 1024 * 1024
+
+    def __init__(self, max_concurrent_ocr: int | None = None):
+        self.use_gpu = _resolve_ocr_use_gpu()
+        # Số lô trang OCR song song: GPU đã bão hòa với 1 lô, CPU chồng được 2 lô
+        self.max_concurrent_ocr = max_concurrent_ocr or (1 if self.use_gpu else 2)
+        # Dùng chung cho mọi request (PDF + ảnh) → 1 Reader không bị gọi chồng quá giới hạn
+        self._ocr_sem = asyncio.Semaphore(self.max_concurrent_ocr)
+        # Chỉ CPU và chỉ khi bật EASYOCR_OPENVINO: chạy detector/recognizer qua OpenVINO
+        self.use_openvino = not self.use_gpu and settings.EASYOCR_OPENVINO
+        if self.use_openvino and importlib.util.find_spec("openvino") is None:
+            logger.warning("⚠️ EASYOCR_OPENVINO bật nhưng chưa cài openvino → dùng PyTorch")
+            self.use_openvino = False
+        logger.info(
+            f"⚙️ Khởi tạo EasyOCR reader (vi) trên {'CUDA' if self.use_gpu else 'CPU'}..."
+        )
+        # Model quantize động của PyTorch không convert được → giữ FP32 khi dùng OpenVINO
+        self.reader = easyocr.Reader(
+            ["vi"], gpu=self.use_gpu, quantize=not self.use_openvino
+        )
+        if self.use_openvino:
+            self._use_openvino_backend()
+        elif self.use_gpu and settings.EASYOCR_TENSORRT:
+            self._use_tensorrt_backend()
+
+    def _use_tensorrt_backend(self) -> None:
+        try:
+            import torch
+            import torch_tensorrt
+        except ImportError as e:
+            logger.warning(f"⚠️ EASYOCR_TENSORRT bật nhưng thiếu torch-tensorrt: {e}")
+            return
+
+        # Build engine 1 lần lúc khởi tạo; shape động theo lô trang / độ rộng dòng chữ
+        self.reader.detector = _compile_tensorrt(
+            "detector",
+            self.reader.detector,
+            [
+                torch_tensorrt.Input(
+                    min_shape=(1, 3, 32, 32),
+                    opt_shape=(self.PAGE_BATCH_SIZE, 3, 1280, 1280),
+                    max_shape=(self.PAGE_BATCH_SIZE, 3, 2560, 2560),
+                )
+            ],
+        )
+        self.reader.recognizer = _compile_tensorrt(
+            "recognizer",
+            self.reader.recognizer,
+            [
+                torch_tensorrt.Input(
+                    min_shape=(1, 1, 64, 32),
+                    opt_shape=(self.RECOG_BATCH_SIZE, 1, 64, 512),
+                    max_shape=(self.RECOG_BATCH_SIZE, 1, 64, 2560),
+                ),
+                torch_tensorrt.Input(
+                    min_shape=(1, 1),
+                    opt_shape=(self.RECOG_BATCH_SIZE, 26),
+                    max_shape=(self.RECOG_BATCH_SIZE, 64),
+                    dtype=torch.int64,
+                ),
+            ],
+        )
+
+    def _use_openvino_backend(self) -> None:
+        import torch
+
+        # Compile 1 lần lúc khởi tạo, shape động theo batch / kích thước ảnh
+        self.reader.detector = _compile_openvino(
+            "detector",
+            self.reader.detector,
+            (torch.zeros(1, 3, 640, 640),),
+            [[-1, 3, -1, -1]],
+        )
+        self.reader.recognizer = _compile_openvino(
+            "recognizer",
+            self.reader.recognizer,
+            (torch.zeros(1, 1, 64, 256), torch.zeros(1, 26, dtype=torch.long)),
+            [[-1, 1, 64, -1], [-1, -1]],
+            int8_weights=True,
+        )
+        # Recognizer không convert được → vẫn giữ INT8 động của PyTorch như Reader mặc định
+        if not isinstance(self.reader.recognizer, _OpenVINOModule):
+            torch.ao.quantization.quantize_dynamic(
+                self.reader.recognizer,
+                {torch.nn.Linear, torch.nn.LSTM},
+                dtype=torch.qint8,
+                inplace=True,
+            )
 
     # ============================================================
     # 📄 OCR PDF
     # ============================================================
-    def extract_text_from_pdf(self, source: Union[str, Path, bytes]) -> str:
+    async def extract_text_from_pdf(self, source: Union[str, Path, bytes]) -> str:
+        """
+        Raster từng cửa sổ PAGE_BATCH_SIZE trang trong thread, OCR các lô trong thread pool
+        (tối đa max_concurrent_ocr lô cùng lúc, tính chung mọi request)
+        → raster trang sau chồng lên OCR trang trước.
+        """
+        pending: set[asyncio.Task] = set()
         try:
-            pdf_bytes = self._load_pdf_bytes(source)
-            pdf_stream = BytesIO(pdf_bytes)
-            results: List[str] = []
+            page_texts: Dict[int, str] = {}
+
+            async def _ocr(batch: List[Tuple[int, Any]], total: int) -> None:
+                async with self._ocr_sem:
+                    await asyncio.to_thread(
+                        self._ocr_page_batch, batch, page_texts, total
+                    )
 
-            with fitz.open(stream=pdf_stream, filetype="pdf") as doc:
+            doc = await asyncio.to_thread(self._open_document, source)
+            try:
                 total_pages = len(doc)
                 logger.info(f"📄 OCR {total_pages} trang PDF (RAM-only)...")
 
-                for i, page in enumerate(doc):
-                    pix = page.get_pixmap(dpi=200)
-                    img = Image.frombytes(
-                        "RGBA" if pix.alpha else "RGB",
-                        (pix.width, pix.height),
-                        pix.samples,
-                    )
-
-                    buf = BytesIO()
-                    img.save(buf, format="PNG")
-                    buf.seek(0)
+                for start in range(0, total_pages, self.PAGE_BATCH_SIZE):
+                    # Không raster vượt quá xa phần OCR (giữ RAM ảnh trang có giới hạn)
+                    while len(pending) > self.max_concurrent_ocr:
+                        done, pending = await asyncio.wait(
+                            pending, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for task in done:
+                            task.result()
 
-                    text_blocks = cast(
-                        List[str],
-                        self.reader.readtext(buf.getvalue(), detail=0, paragraph=True),
+                    end = min(start + self.PAGE_BATCH_SIZE, total_pages)
+                    # fitz.Document không an toàn đa luồng → raster tuần tự, 1 thread/lượt
+                    buckets = await asyncio.to_thread(
+                        self._render_pages, doc, start, end
                     )
-                    page_text = "\n".join(text_blocks).strip()
-                    if page_text:
-                        results.append(page_text)
-                        logger.info(
-                            f"✅ Trang {i+1}/{total_pages}: {len(page_text)} ký tự"
-                        )
+                    for bucket in buckets:
+                        pending.add(asyncio.create_task(_ocr(bucket, total_pages)))
+
+                await asyncio.gather(*pending)
+                pending.clear()
+            finally:
+                doc.close()
 
+            # Ghép lại theo đúng thứ tự trang
+            results = [page_texts[i] for i in sorted(page_texts)]
             if not results:
                 raise RuntimeError("❌ Không trích xuất được nội dung PDF.")
             return "\n\n".join(results)
 
         except Exception as e:
+            for task in pending:
+                task.cancel()
             logger.exception(f"❌ Lỗi OCR PDF: {e}")
             raise RuntimeError(f"Lỗi OCR PDF: {e}") from e
 
-    async def _detect_type(self, content_type: str) -> str:
+    def _render_pages(
+        self, doc: fitz.Document, start: int, end: int
+    ) -> List[List[Tuple[int, Any]]]:
+        """
+        Raster các trang [start, end) và gom theo kích thước ảnh
+        (readtext_batched cần ảnh cùng kích thước, không resize/padding).
+        """
+        buckets: Dict[Tuple[int, int], List[Tuple[int, Any]]] = {}
+        for i in range(start, end):
+            page = doc[i]
+            # Trang khổ lớn đã đủ chi tiết ở DPI thấp → ít pixel cho detector CNN
+            dpi = (
+                self.LARGE_PAGE_DPI
+                if page.rect.width * self.PAGE_DPI / 72 > self.LARGE_PAGE_MAX_PX
+                else self.PAGE_DPI
+            )
+            # Raster thẳng grayscale 1 kênh (EasyOCR nhận ảnh xám) → ít pixel hơn RGB 3 lần
+            pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+            # Đưa thẳng pixel (numpy) cho EasyOCR, không encode PNG rồi decode lại
+            arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(
+                pix.height, pix.width
+            )
+            buckets.setdefault((pix.width, pix.height), []).append((i, arr))
+            pix = None  # arr đã giữ bản sao samples, nhả pixmap ngay
+
+        # Store MuPDF mặc định không giới hạn → PDF scan dài có thể phình >1GB
+        if fitz.TOOLS.store_size > self.FITZ_STORE_CAP:
+            fitz.TOOLS.store_shrink(100)
+        return list(buckets.values())
+
+    def _ocr_page_batch(
+        self,
+        pages: List[Tuple[int, Any]],
+        page_texts: Dict[int, str],
+        total_pages: int,
+    ) -> None:
+        """OCR 1 lô trang cùng kích thước bằng 1 lần gọi readtext_batched."""
+        batched = cast(
+            List[List[str]],
+            self.reader.readtext_batched(
+                [img for _, img in pages],
+                batch_size=self.RECOG_BATCH_SIZE,
+                detail=0,
+                paragraph=True,
+            ),
+        )
+        for (i, _), text_blocks in zip(pages, batched):
+            page_text = "\n".join(text_blocks).strip()
+            if page_text:
+                page_texts[i] = page_text
+                logger.info(f"✅ Trang {i+1}/{total_pages}: {len(page_text)} ký tự")
+
+    def _detect_type(self, content_type: str) -> str:
         """
         Hàm xác định loại tài nguyên (resource_type) dựa trên content_type của file.
 
@@ -77,36 +378,24 @@ class OCRService:
         Returns:
             str: Loại tài nguyên ('pdf', 'image', 'text', 'unknown')
         """
-        if not content_type:
-            return "unknown"
-
-        if "pdf" in content_type:
-            return "pdf"
-        elif "image" in content_type:
-            return "image"
-        elif "text" in content_type or "plain" in content_type:
-            return "text"
-        elif "json" in content_type:
-            return "json"
-        elif "video" in content_type:
-            return "video"
-        elif "audio" in content_type:
-            return "audio"
-        else:
-            return "unknown"
+        m = _MIME_RE.search(content_type or "")
+        return _MIME_ALIASES.get(m.group(), m.group()) if m else "unknown"
 
     # ============================================================
     # 🖼️ OCR ẢNH
     # ============================================================
-    def extract_text_from_image(self, source: Union[str, Path, bytes]) -> str:
+    async def extract_text_from_image(self, source: Union[str, Path, bytes]) -> str:
         try:
-            image_bytes = self._load_image_bytes(source)
+            image_bytes = await asyncio.to_thread(self._load_image_bytes, source)
             logger.info("🖼️ Đang OCR ảnh từ RAM...")
 
-            text_blocks = cast(
-                List[str],
-                self.reader.readtext(image_bytes, detail=0, paragraph=True),
-            )
+            async with self._ocr_sem:
+                text_blocks = cast(
+                    List[str],
+                    await asyncio.to_thread(
+                        self.reader.readtext, image_bytes, detail=0, paragraph=True
+                    ),
+                )
             text = "\n".join(text_blocks).strip()
             if not text:
                 raise RuntimeError("❌ Không trích xuất được text từ ảnh.")
@@ -119,14 +408,24 @@ class OCRService:
     # ============================================================
     # 🔧 Helper: Load dữ liệu
     # ============================================================
+    def _open_document(self, source: Union[str, Path, bytes]) -> fitz.Document:
+        """File local → để MuPDF tự đọc từ đĩa (không nạp toàn bộ vào RAM)."""
+        if isinstance(source, Path) or (
+            isinstance(source, str) and not re.match(r"^https?://", source)
+        ):
+            pdf_path = Path(source)
+            if not pdf_path.exists():
+                raise FileNotFoundError(f"Không tìm thấy file PDF: {pdf_path}")
+            return fitz.open(pdf_path)
+        pdf_bytes = self._load_pdf_bytes(source)
+        return fitz.open(stream=BytesIO(pdf_bytes), filetype="pdf")
+
     def _load_pdf_bytes(self, source: Union[str, Path, bytes]) -> bytes:
         if isinstance(source, bytes):
             return source
         if isinstance(source, str) and re.match(r"^https?://", source):
             logger.info(f"🌐 Tải PDF từ URL: {source}")
-            with httpx.stream("GET", source, timeout=60.0) as resp:
-                resp.raise_for_status()
-                return b"".join(resp.iter_bytes())
+            return _download_bytes(source, timeout=60.0)
         pdf_path = Path(source)
         if not pdf_path.exists():
             raise FileNotFoundError(f"Không tìm thấy file PDF: {pdf_path}")
@@ -136,9 +435,7 @@ class OCRService:
         if isinstance(source, bytes):
             return source
         if isinstance(source, str) and re.match(r"^https?://", source):
-            with httpx.stream("GET", source, timeout=30.0) as resp:
-                resp.raise_for_status()
-                return b"".join(resp.iter_bytes())
+            return _download_bytes(source, timeout=30.0)
         img_path = Path(source)
         if not img_path.exists():
             raise FileNotFoundError(f"Không tìm thấy file ảnh: {img_path}")
@@ -161,3 +458,25 @@ def get_ocr_service() -> OCRService:
         logger.info("🚀 Tạo OCRService singleton (lần đầu tiên)")
         _ocr_service_instance = OCRService()
     return _ocr_service_instance
+
+
+def preload_ocr_service() -> None:
+    """
+    Nạp model EasyOCR ở process cha trước khi gunicorn (--preload) fork worker:
+    trọng số nằm trong shared memory → các worker dùng chung trang nhớ thay vì mỗi worker ~800MB.
+    Chỉ áp dụng cho CPU (không fork được CUDA context đã khởi tạo).
+    """
+    if _ocr_service_instance is not None:
+        return
+    if _resolve_ocr_use_gpu():
+        logger.info("ℹ️ EasyOCR chạy CUDA → bỏ qua preload trước fork, nạp lazy trong worker.")
+        return
+
+    import torch
+
+    # N worker cùng chạy → mỗi worker 1 luồng intra-op để không tranh CPU
+    torch.set_num_threads(1)
+    service = get_ocr_service()
+    for module in (service.reader.detector, service.reader.recognizer):
+        if isinstance(module, torch.nn.Module):
+            module.share_memory()
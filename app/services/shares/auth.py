@@ -1,20 +1,28 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
 from datetime import timedelta
-from typing import Any
+from typing import Any, Dict, Tuple
 
 from fastapi import Depends, HTTPException, Response, status
 from google.auth.transport import requests
 from google.oauth2 import id_token
-from sqlalchemy import func, select
+from sqlalchemy import exists, func, insert, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import load_only, selectinload
 from sqlalchemy.sql.expression import desc
 
 from app.core.security import SecurityService
 from app.core.settings import settings
 from app.db.models.database import EmailVerifications, Role, User, UserRoles
-from app.db.sesson import get_session
+from app.db.sesson import AsyncSessionLocal, get_session
 from app.libs.formats.datetime import now as get_now
 from app.schemas.auth.user import (
     GoogleLogin,
@@ -23,7 +31,85 @@ from app.schemas.auth.user import (
     UserCreate,
     VerifyEmail,
 )
-from app.services.shares.mailer import MailerService
+from app.services.shares.mailer import MailerService, send_in_background
+
+# Các cột login (thường + Google) thực sự đọc tới
+_LOGIN_USER_COLUMNS = (
+    User.email,
+    User.password,
+    User.is_verified_email,
+    User.is_banned,
+    User.banned_reason,
+    User.banned_until,
+    User.deleted_at,
+    User.deleted_until,
+)
+
+# Giá trị cột password của tài khoản đăng ký bằng Google (không phải hash bcrypt)
+GOOGLE_OAUTH_PASSWORD = "google-oauth"
+
+# Cache claims của Google ID token đã verify chữ ký: sha256(credential) -> (hạn, claims)
+# Hạn = min(TTL, exp của token) → token hết hạn không bao giờ được dùng lại từ cache.
+# OrderedDict theo thứ tự chèn: đầy thì bỏ entry cũ nhất (chạy trong thread → có lock)
+GOOGLE_TOKEN_CACHE_TTL = 300
+GOOGLE_TOKEN_CACHE_MAX = 1024
+_GOOGLE_TOKEN_CACHE: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_google_token_lock = threading.Lock()
+
+
+def _verify_google_credential(credential: str) -> Dict[str, Any]:
+    key = hashlib.sha256(credential.encode("utf-8")).hexdigest()
+    now = time.time()
+    with _google_token_lock:
+        entry = _GOOGLE_TOKEN_CACHE.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                return entry[1]
+            del _GOOGLE_TOKEN_CACHE[key]
+
+    info = id_token.verify_oauth2_token(
+        credential,
+        requests.Request(),
+        settings.GOOGLE_API_CLIENT_ID_LOGIN_GOOGLE,
+    )
+    expires_at = min(now + GOOGLE_TOKEN_CACHE_TTL, float(info.get("exp", 0)))
+    if expires_at > now:
+        with _google_token_lock:
+            _GOOGLE_TOKEN_CACHE[key] = (expires_at, info)
+            _GOOGLE_TOKEN_CACHE.move_to_end(key)
+            while len(_GOOGLE_TOKEN_CACHE) > GOOGLE_TOKEN_CACHE_MAX:
+                _GOOGLE_TOKEN_CACHE.popitem(last=False)
+    return info
+
+
+# Role USER gần như bất biến → cache id trong process, chỉ query lần đầu
+_USER_ROLE_ID: uuid.UUID | None = None
+_role_lock = asyncio.Lock()
+
+
+async def _get_user_role_id() -> uuid.UUID:
+    global _USER_ROLE_ID
+    if _USER_ROLE_ID:
+        return _USER_ROLE_ID
+    async with _role_lock:
+        if _USER_ROLE_ID:
+            return _USER_ROLE_ID
+        # Get-or-create nguyên tử (ON CONFLICT role_unique) trong session riêng, commit ngay
+        # → id luôn trỏ tới dòng đã commit, cache an toàn dù request gọi tới rollback
+        async with AsyncSessionLocal() as db:
+            _USER_ROLE_ID = await db.scalar(
+                pg_insert(Role)
+                .values(
+                    role_name="USER",
+                    details="Customers use the service of the system",
+                )
+                .on_conflict_do_update(
+                    index_elements=["role_name"], set_={"role_name": "USER"}
+                )
+                .returning(Role.id)
+            )
+            await db.commit()
+        return _USER_ROLE_ID
 
 
 class AuthService:
@@ -39,10 +125,11 @@ class AuthService:
 
     async def login_async(self, schema: LoginUser, res: Response):
         try:
+            # Login không dùng roles → chỉ lấy các cột cần check, bỏ qua embedding/profile
             stmt = (
                 select(User)
                 .where(User.email == schema.email)
-                .options(selectinload(User.user_roles).selectinload(UserRoles.role))
+                .options(load_only(*_LOGIN_USER_COLUMNS))
             )
             result = await self.db.execute(stmt)
             user: User | None = result.scalar()
@@ -56,8 +143,9 @@ class AuthService:
                         "message": "Email hoặc mật khẩu không đúng",
                     }
                 )
-            if not await self.security.verify_password(
-                schema.password, user.password or ""
+            # Tài khoản tạo qua Google không có mật khẩu → bỏ qua bcrypt
+            if user.password in (None, "", GOOGLE_OAUTH_PASSWORD) or not (
+                await self.security.verify_password(schema.password, user.password)
             ):
                 raise HTTPException(
                     status_code=401,
@@ -93,10 +181,14 @@ class AuthService:
             # 4️⃣ TÀI KHOẢN BỊ KHÓA (BANNED)
             if user.is_banned:
                 # Kiểm tra nếu đã hết hạn ban → tự động mở khóa
-                if user.banned_until and user.banned_until < get_now():
-                    user.is_banned = False
-                    user.banned_reason = None
-                    user.banned_until = None
+                # (UPDATE có điều kiện: request song song không mở khóa 2 lần / ghi đè ban mới)
+                now = get_now()
+                if user.banned_until and user.banned_until < now:
+                    await self.db.execute(
+                        update(User)
+                        .where(User.id == user.id, User.banned_until < now)
+                        .values(is_banned=False, banned_reason=None, banned_until=None)
+                    )
                     await self.db.commit()
                 else:
                     # Xác định loại ban
@@ -129,45 +221,50 @@ class AuthService:
 
     async def register_async(self, schema: UserCreate) -> dict[str, Any]:
         try:
-            existing_id = (
-                await self.db.scalars(select(User.id).where(User.email == schema.email))
-            ).first()
-            if existing_id:
+            now = get_now()
+            # Chỉ probe index (EXISTS), không kéo dòng về; chặn sớm trước khi băm bcrypt
+            if await self.db.scalar(
+                select(exists().where(User.email == schema.email))
+            ):
                 raise HTTPException(
                     status_code=status.HTTP_409_CONFLICT,
                     detail="Email already registered",
                 )
-            new_user = User()
+            # Sinh id phía app → không cần flush giữa chừng, mọi INSERT đi cùng lúc commit
+            new_user = User(id=uuid.uuid4())
             new_user.email = schema.email
             new_user.fullname = schema.full_name if schema.full_name else ""
             password_hash = await self.security.hash_password(schema.password)
             new_user.is_active = False
             new_user.password = password_hash
-            new_user.create_at = get_now()
-            self.db.add(new_user)
-            await self.db.flush()
+            new_user.create_at = now
 
             # ✅ GÁN ROLE USER MẶC ĐỊNH NGAY KHI TẠO TÀI KHOẢN
-            role = await self.db.scalar(select(Role).where(Role.role_name == "USER"))
-            if not role:
-                role = Role(
-                    role_name="USER",
-                    details="Customers use the service of the system",
-                )
-                self.db.add(role)
-                await self.db.flush()
-            self.db.add(UserRoles(user_id=new_user.id, role_id=role.id))
-
+            role_id = await _get_user_role_id()
             code = await self.security.generate_otp()
-            expired_at = get_now() + timedelta(minutes=5)
-            verification = EmailVerifications(
-                user_id=new_user.id, code=code, expired_at=expired_at
+            self.db.add_all(
+                [
+                    new_user,
+                    UserRoles(user_id=new_user.id, role_id=role_id),
+                    EmailVerifications(
+                        user_id=new_user.id,
+                        code=code,
+                        expired_at=now + timedelta(minutes=5),
+                    ),
+                ]
             )
-            self.db.add(verification)
-            await self.db.commit()
-            await self.db.refresh(new_user)
-            await self.mail_service.send_verification_email(
-                schema.email, schema.full_name or "", code
+            try:
+                await self.db.commit()
+            except IntegrityError:
+                # 2 request đăng ký cùng email chạy song song → unique user_unique chặn lại
+                raise HTTPException(
+                    status_code=status.HTTP_409_CONFLICT,
+                    detail="Email already registered",
+                )
+            send_in_background(
+                self.mail_service.send_verification_email(
+                    schema.email, schema.full_name or "", code
+                )
             )
             return {"message": "send Email ok"}
         except Exception:
@@ -187,50 +284,73 @@ class AuthService:
 
     async def refesh_email_async(self, schema: RefreshEmail):
         try:
-            today_start = get_now().replace(hour=0, minute=0, second=0, microsecond=0)
-            tomorrow_start = today_start + timedelta(days=1)
-            user = (
-                await self.db.scalars(select(User).where((User.email == schema.email)))
-            ).first()
-            if not user:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
-                )
-            if user.is_verified_email == True:
-                raise HTTPException(
-                    status_code=status.HTTP_409_CONFLICT, detail="User is veryed Email"
-                )
+            now = get_now()
+            today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            code = await self.security.generate_otp()
 
-            stmt = (
+            # 1 câu INSERT ... SELECT: chỉ chèn mã mới khi user tồn tại, chưa xác thực
+            # và chưa vượt giới hạn gửi trong ngày (đếm + chèn trong cùng 1 statement)
+            sent_today = (
                 select(func.count())
                 .select_from(EmailVerifications)
-                .join(User, User.id == EmailVerifications.user_id)
                 .where(
-                    User.id == user.id,
+                    EmailVerifications.user_id == User.id,
                     EmailVerifications.created_at >= today_start,
-                    EmailVerifications.created_at < tomorrow_start,
                 )
+                .correlate(User)
+                .scalar_subquery()
             )
-            count_result = await self.db.execute(stmt)
-            verification_count = count_result.scalar_one()
-            # return verification_count
-            if verification_count > 5:
+            fullname = (
+                select(User.fullname)
+                .where(User.id == EmailVerifications.user_id)
+                .correlate(EmailVerifications)
+                .scalar_subquery()
+            )
+            stmt = (
+                insert(EmailVerifications)
+                .from_select(
+                    ["user_id", "code", "expired_at"],
+                    select(
+                        User.id,
+                        literal(code),
+                        literal(now + timedelta(minutes=5)),
+                    ).where(
+                        User.email == schema.email,
+                        User.is_verified_email.is_not(True),
+                        sent_today <= 5,
+                    ),
+                )
+                .returning(fullname)
+            )
+            inserted = (await self.db.execute(stmt)).first()
+
+            if not inserted:
+                # Không chèn được → tra 1 lần để trả đúng lỗi
+                is_verified = (
+                    await self.db.execute(
+                        select(User.is_verified_email).where(
+                            User.email == schema.email
+                        )
+                    )
+                ).first()
+                if not is_verified:
+                    raise HTTPException(
+                        status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
+                    )
+                if is_verified[0] == True:
+                    raise HTTPException(
+                        status_code=status.HTTP_409_CONFLICT, detail="User is veryed Email"
+                    )
                 raise HTTPException(
                     status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                     detail="Bạn đã gửi quá 5 lần trong hôm nay",
                 )
-            code = await self.security.generate_otp()
-            self.db.add(
-                EmailVerifications(
-                    user_id=user.id,
-                    code=code,
-                    expired_at=get_now() + timedelta(minutes=5),
-                )
-            )
+
             await self.db.commit()
-            await self.db.refresh(user)
-            await self.mail_service.send_verification_email(
-                email=schema.email, fullname=user.fullname, code=code
+            send_in_background(
+                self.mail_service.send_verification_email(
+                    email=schema.email, fullname=inserted[0] or "", code=code
+                )
             )
             return True
 
@@ -240,34 +360,47 @@ class AuthService:
 
     async def verify_email_async(self, schema: VerifyEmail, res: Response):
         try:
-            user: User | None = await self.db.scalar(
-                select(User)
-                .options(selectinload(User.user_roles).selectinload(UserRoles.role))
-                .where(User.email == schema.email)
-            )
-            if not user:
+            now = get_now()
+            # 1 query: user + mã xác thực mới nhất (outer join, lấy dòng mới nhất)
+            row = (
+                await self.db.execute(
+                    select(User, EmailVerifications)
+                    .outerjoin(
+                        EmailVerifications, EmailVerifications.user_id == User.id
+                    )
+                    .options(
+                        load_only(
+                            User.fullname,
+                            User.email,
+                            User.avatar,
+                            User.bio,
+                            User.facebook_url,
+                            User.is_verified_email,
+                        ),
+                        selectinload(User.user_roles).selectinload(UserRoles.role),
+                    )
+                    .where(User.email == schema.email)
+                    .order_by(desc(EmailVerifications.created_at).nulls_last())
+                    .limit(1)
+                )
+            ).first()
+            if not row:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
                 )
+            user, email_verify = row
 
             if user.is_verified_email:
                 raise HTTPException(
                     status_code=status.HTTP_409_CONFLICT,
                     detail="Người dùng đã xác thực email",
                 )
-            email_verify = (
-                await self.db.scalars(
-                    select(EmailVerifications)
-                    .where(EmailVerifications.user_id == user.id)
-                    .order_by(desc(EmailVerifications.created_at))
-                )
-            ).first()
             if not email_verify:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Mã xác thực không hợp lệ hoặc đã hết hạn.",
                 )
-            if email_verify.expired_at < get_now():
+            if email_verify.expired_at < now:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Mã xác thực không hợp lệ hoặc đã hết hạn.",
@@ -276,10 +409,9 @@ class AuthService:
             # User đã được gán role USER từ lúc register, chỉ cần cập nhật trạng thái
             user.is_verified_email = True
             user.is_active = True
-            user.email_verified_at = get_now()
-            user.update_at = get_now()
+            user.email_verified_at = now
+            user.update_at = now
             await self.db.commit()
-            await self.db.refresh(user)
             res.set_cookie(
                 key="access_token",
                 value=await self.security.create_access_token(str(user.id)),
@@ -349,10 +481,8 @@ class AuthService:
     async def login_google_async(self, schema: GoogleLogin, res: Response):
         try:
             # 1) VERIFY GOOGLE ID TOKEN
-            info = id_token.verify_oauth2_token(
-                schema.credential,
-                requests.Request(),
-                settings.GOOGLE_API_CLIENT_ID_LOGIN_GOOGLE,
+            info = await asyncio.to_thread(
+                _verify_google_credential, schema.credential
             )
 
             google_uid = info.get("sub")
@@ -363,11 +493,13 @@ class AuthService:
             if not email:
                 raise HTTPException(400, "Google không trả về email hợp lệ")
 
+            now = get_now()
+
             # 2) TÌM USER TRONG DB
             stmt = (
                 select(User)
                 .where(User.email == email)
-                .options(selectinload(User.user_roles).selectinload(UserRoles.role))
+                .options(load_only(*_LOGIN_USER_COLUMNS))
             )
             user = (await self.db.execute(stmt)).scalar_one_or_none()
 
@@ -376,37 +508,26 @@ class AuthService:
             # ─────────────────────────────────────────────
             if not user:
                 user = User(
+                    id=uuid.uuid4(),
                     email=email,
                     fullname=fullname or "",
                     avatar=avatar,
-                    password="google-oauth",  # không dùng mật khẩu
+                    password=GOOGLE_OAUTH_PASSWORD,  # không dùng mật khẩu
                     is_verified_email=True,  # Google đảm bảo email verified
-                    email_verified_at=get_now(),
+                    email_verified_at=now,
                     is_active=True,
-                    create_at=get_now(),
-                    update_at=get_now(),
+                    create_at=now,
+                    update_at=now,
+                    # gán sẵn để check bên dưới không phải đọc lại từ DB
+                    is_banned=False,
+                    deleted_at=None,
                 )
 
-                self.db.add(user)
-                await self.db.flush()
-
-                # tìm role USER
-                role = await self.db.scalar(
-                    select(Role).where(Role.role_name == "USER")
-                )
-                if not role:
-                    role = Role(
-                        role_name="USER",
-                        details="Customers use the service of the system",
-                    )
-                    self.db.add(role)
-                    await self.db.flush()
-
-                # add vai trò cho user mới
-                self.db.add(UserRoles(user_id=user.id, role_id=role.id))
+                # add vai trò USER cho user mới (user + role insert chung 1 lần flush khi commit)
+                role_id = await _get_user_role_id()
+                self.db.add_all([user, UserRoles(user_id=user.id, role_id=role_id)])
 
                 await self.db.commit()
-                await self.db.refresh(user)
 
             # ─────────────────────────────────────────────
             # 4) CHECK TÀI KHOẢN ĐÃ BỊ XÓA
@@ -426,11 +547,13 @@ class AuthService:
             # 5) CHECK BANNED ACCOUNT
             # ─────────────────────────────────────────────
             if user.is_banned:
-                if user.banned_until and user.banned_until < get_now():
+                if user.banned_until and user.banned_until < now:
                     # hết hạn ban → mở lại
-                    user.is_banned = False
-                    user.banned_reason = None
-                    user.banned_until = None
+                    await self.db.execute(
+                        update(User)
+                        .where(User.id == user.id, User.banned_until < now)
+                        .values(is_banned=False, banned_reason=None, banned_until=None)
+                    )
                     await self.db.commit()
                 else:
                     is_permanent = user.banned_until is None
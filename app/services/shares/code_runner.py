@@ -2,8 +2,9 @@ from datetime import datetime
 from typing import Any, Dict, List, Optional
 
 import httpx
+import orjson
 from loguru import logger
-from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.settings import settings
@@ -16,6 +17,24 @@ class PistonService:
 
     def __init__(self):
         self.base_url = settings.PISTON_URL
+        self._client: Optional[httpx.AsyncClient] = None
+        # ETag của lần sync /runtimes thành công gần nhất → lần sau gửi If-None-Match
+        self._runtimes_etag: Optional[str] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """1 AsyncClient dùng chung (giữ connection pool) cho mọi lần gọi Piston."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=20,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     # =========================================================
     # 🧠 1️⃣ RUN CODE — TỰ ĐỘNG PHÂN BIỆT 1 FILE / NHIỀU FILE
@@ -40,7 +59,6 @@ class PistonService:
         if len(files) == 1 and "name" not in files[0]:
             files[0]["name"] = "main"
 
-        url = f"{self.base_url}/api/v2/execute"
         payload = {
             "language": language,
             "version": version,
@@ -49,61 +67,80 @@ class PistonService:
         if stdin:
             payload["stdin"] = stdin
 
-        async with httpx.AsyncClient(timeout=20) as client:
-            try:
-                resp = await client.post(url, json=payload)
-                resp.raise_for_status()
-                data = resp.json()
-                logger.info(
-                    f"✅ Piston run ok: {language} ({len(files)} file{'s' if len(files)>1 else ''})"
-                )
-                return data
-            except httpx.HTTPStatusError as e:
-                logger.error(f"❌ HTTP {e.response.status_code}: {e.response.text}")
-                raise
-            except Exception as e:
-                logger.error(f"❌ Lỗi gọi piston: {e}")
-                raise
+        client = self._get_client()
+        try:
+            resp = await client.post("/api/v2/execute", json=payload)
+            resp.raise_for_status()
+            data = orjson.loads(resp.content)
+            logger.info(
+                f"✅ Piston run ok: {language} ({len(files)} file{'s' if len(files)>1 else ''})"
+            )
+            return data
+        except httpx.HTTPStatusError as e:
+            logger.error(f"❌ HTTP {e.response.status_code}: {e.response.text}")
+            raise
+        except Exception as e:
+            logger.error(f"❌ Lỗi gọi piston: {e}")
+            raise
 
     # =========================================================
     # 🔁 2️⃣ SYNC RUNTIMES — ĐỒNG BỘ DANH SÁCH HỖ TRỢ
     # =========================================================
     async def sync_supported_languages(self, db: AsyncSession) -> int:
-        url = f"{self.base_url}/api/v2/runtimes"
-
-        async with httpx.AsyncClient(timeout=15) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            runtimes = resp.json()
+        client = self._get_client()
+        headers = {"If-None-Match": self._runtimes_etag} if self._runtimes_etag else {}
+        resp = await client.get("/api/v2/runtimes", headers=headers)
+        if resp.status_code == 304:
+            # Danh sách runtime không đổi từ lần sync trước → không cần đụng DB
+            logger.info("✅ Runtime Piston không đổi (304), bỏ qua đồng bộ")
+            return 0
+        resp.raise_for_status()
+        runtimes = orjson.loads(resp.content)
+
+        synced_at = to_utc_naive(get_now())
+        # Gộp trùng (name, version) ngay trong danh sách trả về
+        rows = {
+            (rt.get("language"), rt.get("version")): {
+                "name": rt.get("language"),
+                "version": rt.get("version"),
+                "aliases": rt.get("aliases", []),
+                "runtime": rt.get("runtime"),
+                "is_active": True,
+                "last_sync": synced_at,
+            }
+            for rt in runtimes
+        }
 
         inserted = 0
-        for rt in runtimes:
-            name = rt.get("language")
-            version = rt.get("version")
-            aliases = rt.get("aliases", [])
-            runtime = rt.get("runtime")
-
-            # Kiểm tra tồn tại (name + version)
-            exists = await db.scalar(
-                select(SupportedLanguages)
-                .where(SupportedLanguages.name == name)
-                .where(SupportedLanguages.version == version)
+        if rows:
+            # 1 câu INSERT, DB tự bỏ qua runtime đã có nhờ unique (name, version)
+            result = await db.execute(
+                pg_insert(SupportedLanguages)
+                .values(list(rows.values()))
+                .on_conflict_do_nothing(index_elements=["name", "version"])
             )
-
-            if exists:
-                continue
-
-            lang = SupportedLanguages(
-                name=name,
-                version=version,
-                aliases=aliases,
-                runtime=runtime,
-                is_active=True,
-                last_sync=await to_utc_naive(get_now()),
-            )
-            db.add(lang)
-            inserted += 1
-
+            inserted = result.rowcount
         await db.commit()
+        # Chỉ ghi nhớ ETag sau khi commit xong (sync lỗi → lần sau tải lại đầy đủ)
+        self._runtimes_etag = resp.headers.get("ETag")
         logger.info(f"✅ Đồng bộ xong {inserted} runtime mới từ Piston")
         return inserted
+
+
+# ============================================================
+# ⚡ Singleton Provider
+# ============================================================
+_piston_service: PistonService | None = None
+
+
+def get_piston_service() -> PistonService:
+    global _piston_service
+    if _piston_service is None:
+        logger.info("🚀 Khởi tạo PistonService lần đầu.")
+        _piston_service = PistonService()
+    return _piston_service
+
+
+async def close_piston_service():
+    if _piston_service is not None:
+        await _piston_service.aclose()
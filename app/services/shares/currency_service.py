@@ -1,13 +1,50 @@
+import asyncio
+import time
+
 import httpx
 
+# Tỷ giá chỉ đổi theo giờ → cache (thời điểm lấy, rate) trong process
+FX_RATE_TTL = 3600
+_rate_cache: tuple[float, float] | None = None
+_rate_lock = asyncio.Lock()
 
-async def convert_vnd_to_usd(amount_vnd: float) -> float:
-    """Đổi VNĐ sang USD (free, không cần API key)."""
-    url = "https://open.er-api.com/v6/latest/VND"
-    async with httpx.AsyncClient() as client:
-        res = await client.get(url)
+# 1 AsyncClient dùng chung (giữ kết nối TLS tới API tỷ giá giữa các lần gọi)
+_client: httpx.AsyncClient | None = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(timeout=10, http2=True)
+    return _client
+
+
+async def close_currency_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _get_vnd_usd_rate() -> float:
+    global _rate_cache
+    if _rate_cache and time.monotonic() - _rate_cache[0] < FX_RATE_TTL:
+        return _rate_cache[1]
+    # 1 request làm mới, các request khác chờ rồi dùng lại kết quả
+    async with _rate_lock:
+        if _rate_cache and time.monotonic() - _rate_cache[0] < FX_RATE_TTL:
+            return _rate_cache[1]
+        url = "https://open.er-api.com/v6/latest/VND"
+        res = await _get_client().get(url)
         data = res.json()
         if data.get("result") != "success":
             raise ValueError("Không lấy được tỷ giá.")
         rate = data["rates"]["USD"]
-        return round(amount_vnd * rate, 2)
+        _rate_cache = (time.monotonic(), rate)
+        return rate
+
+
+async def convert_vnd_to_usd(amount_vnd: float) -> float:
+    """Đổi VNĐ sang USD (free, không cần API key)."""
+    rate = await _get_vnd_usd_rate()
+    return round(amount_vnd * rate, 2)
@@ -178,8 +178,8 @@ class DiscountService:
                 fixed_value=schema.fixed_value,
                 usage_limit=schema.usage_limit,
                 per_user_limit=schema.per_user_limit,
-                start_at=await to_utc_naive(schema.start_at),
-                end_at=await to_utc_naive(schema.end_at),
+                start_at=to_utc_naive(schema.start_at),
+                end_at=to_utc_naive(schema.end_at),
                 is_active=True,
             )
 
@@ -1,6 +1,7 @@
+import asyncio
 import json
 import os
-from typing import Any, Dict, List, Optional
+from typing import Any, BinaryIO, Dict, List, Optional, Union
 
 import aiofiles
 import httpx
@@ -24,6 +25,10 @@ class GoogleDriveAsyncService:
         "https://www.googleapis.com/auth/youtube",
     ]
 
+    # File > 8MB dùng resumable upload, mỗi chunk 8MB (bội số của 256KB)
+    RESUMABLE_THRESHOLD = 8 * 1024 * 1024
+    RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+
     TOKEN_PATH = "app/core/secret/token.json"
     CLIENT_SECRET_PATH = "app/core/secret/client_secret.json"
 
@@ -33,6 +38,18 @@ class GoogleDriveAsyncService:
         self.upload_url = "https://www.googleapis.com/upload/drive/v3/files"
         self.creds = creds
         self._access_token: Optional[str] = creds.token if creds else None
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """1 AsyncClient dùng chung (giữ connection pool / TLS) cho mọi request Drive."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=180)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     # ===========================================================
     @classmethod
@@ -128,33 +145,33 @@ class GoogleDriveAsyncService:
         parts = path.strip("/").split("/")
         parent_id = None
 
-        async with httpx.AsyncClient(timeout=60) as client:
-            for name in parts:
-                query = f"name='{name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+        client = self._get_client()
+        for name in parts:
+            query = f"name='{name}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+            if parent_id:
+                query += f" and '{parent_id}' in parents"
+
+            r = await client.get(
+                f"{self.base_url}/files",
+                headers=headers,
+                params={"q": query, "fields": "files(id,name)"},
+            )
+            folders = r.json().get("files", [])
+
+            if folders:
+                parent_id = folders[0]["id"]
+            else:
+                meta = {
+                    "name": name,
+                    "mimeType": "application/vnd.google-apps.folder",
+                }
                 if parent_id:
-                    query += f" and '{parent_id}' in parents"
+                    meta["parents"] = [parent_id]
 
-                r = await client.get(
-                    f"{self.base_url}/files",
-                    headers=headers,
-                    params={"q": query, "fields": "files(id,name)"},
+                r = await client.post(
+                    f"{self.base_url}/files", headers=headers, data=json.dumps(meta)
                 )
-                folders = r.json().get("files", [])
-
-                if folders:
-                    parent_id = folders[0]["id"]
-                else:
-                    meta = {
-                        "name": name,
-                        "mimeType": "application/vnd.google-apps.folder",
-                    }
-                    if parent_id:
-                        meta["parents"] = [parent_id]
-
-                    r = await client.post(
-                        f"{self.base_url}/files", headers=headers, data=json.dumps(meta)
-                    )
-                    parent_id = r.json().get("id")
+                parent_id = r.json().get("id")
 
         return parent_id
 
@@ -163,9 +180,13 @@ class GoogleDriveAsyncService:
         self,
         path_parts: List[str],
         file_name: str,
-        content: bytes,
+        content: Union[bytes, BinaryIO],
         mime_type: Optional[str] = None,
     ) -> Dict[str, Any]:
+        """
+        Upload 1 file lên Drive.
+        `content` có thể là bytes hoặc file object (httpx đọc stream theo chunk).
+        """
 
         folder_path = "Elearn_Uploader/" + "/".join(path_parts)
         folder_id = await self.ensure_folder(folder_path)
@@ -173,32 +194,97 @@ class GoogleDriveAsyncService:
         access_token = await self._get_access_token()
         mime_type = mime_type or "application/octet-stream"
 
-        if len(content) > 2 * 1024 * 1024 * 1024:
+        if isinstance(content, (bytes, bytearray)):
+            size = len(content)
+        else:
+            pos = content.tell()
+            content.seek(0, os.SEEK_END)
+            size = content.tell() - pos
+            content.seek(pos)
+
+        if size > 2 * 1024 * 1024 * 1024:
             raise ValueError("❌ File vượt quá 2GB.")
 
         headers = {"Authorization": f"Bearer {access_token}"}
         metadata = {"name": file_name, "parents": [folder_id]}
 
+        # File lớn dạng file object → resumable upload theo chunk (RAM ~ 1 chunk)
+        if not isinstance(content, (bytes, bytearray)) and size > self.RESUMABLE_THRESHOLD:
+            return await self._upload_resumable(
+                headers, metadata, content, size, mime_type
+            )
+
         files = {
             "metadata": ("metadata.json", json.dumps(metadata), "application/json"),
             "file": (file_name, content, mime_type),
         }
 
-        async with httpx.AsyncClient(timeout=180) as client:
-            r = await client.post(
-                f"{self.upload_url}?uploadType=multipart", headers=headers, files=files
-            )
+        client = self._get_client()
+        r = await client.post(
+            f"{self.upload_url}?uploadType=multipart", headers=headers, files=files
+        )
+
+        if r.status_code not in (200, 201):
+            raise RuntimeError(f"❌ Upload thất bại: {r.text}")
 
-            if r.status_code not in (200, 201):
+        data = r.json()
+
+        return {
+            "id": data.get("id"),
+            "name": data.get("name"),
+            "webViewLink": f"https://drive.google.com/file/d/{data['id']}/view",
+        }
+
+    # ===========================================================
+    async def _upload_resumable(
+        self,
+        headers: Dict[str, str],
+        metadata: Dict[str, Any],
+        content: BinaryIO,
+        size: int,
+        mime_type: str,
+    ) -> Dict[str, Any]:
+        """Resumable upload: tạo session rồi PUT từng chunk với Content-Range."""
+        client = self._get_client()
+        r = await client.post(
+            f"{self.upload_url}?uploadType=resumable",
+            headers={
+                **headers,
+                "Content-Type": "application/json; charset=UTF-8",
+                "X-Upload-Content-Type": mime_type,
+                "X-Upload-Content-Length": str(size),
+            },
+            content=json.dumps(metadata),
+        )
+        if r.status_code not in (200, 201):
+            raise RuntimeError(f"❌ Tạo phiên upload thất bại: {r.text}")
+        session_url = r.headers["Location"]
+
+        start = 0
+        while start < size:
+            chunk = await asyncio.to_thread(content.read, self.RESUMABLE_CHUNK_SIZE)
+            if not chunk:
+                break
+            end = start + len(chunk) - 1
+            r = await client.put(
+                session_url,
+                headers={"Content-Range": f"bytes {start}-{end}/{size}"},
+                content=chunk,
+            )
+            # 308 = Resume Incomplete → gửi chunk tiếp theo
+            if r.status_code not in (200, 201, 308):
                 raise RuntimeError(f"❌ Upload thất bại: {r.text}")
+            start = end + 1
 
-            data = r.json()
+        if r.status_code not in (200, 201):
+            raise RuntimeError(f"❌ Upload chưa hoàn tất: {r.text}")
 
-            return {
-                "id": data.get("id"),
-                "name": data.get("name"),
-                "webViewLink": f"https://drive.google.com/file/d/{data['id']}/view",
-            }
+        data = r.json()
+        return {
+            "id": data.get("id"),
+            "name": data.get("name"),
+            "webViewLink": f"https://drive.google.com/file/d/{data['id']}/view",
+        }
 
     # ===========================================================
     async def create_share_link(self, file_id: str) -> Dict[str, str]:
@@ -213,27 +299,27 @@ class GoogleDriveAsyncService:
             "Content-Type": "application/json",
         }
 
-        async with httpx.AsyncClient(timeout=30) as client:
-            # Tạo permission public
-            r = await client.post(
-                f"{self.base_url}/files/{file_id}/permissions",
-                headers=headers,
-                data=json.dumps({"role": "reader", "type": "anyone"}),
-            )
+        client = self._get_client()
+        # Tạo permission public
+        r = await client.post(
+            f"{self.base_url}/files/{file_id}/permissions",
+            headers=headers,
+            data=json.dumps({"role": "reader", "type": "anyone"}),
+        )
 
-            if r.status_code not in (200, 201):
-                raise RuntimeError(f"❌ Lỗi tạo permission: {r.text}")
+        if r.status_code not in (200, 201):
+            raise RuntimeError(f"❌ Lỗi tạo permission: {r.text}")
 
-            # ❗ Kiểm tra permission thực sự
-            check = await client.get(
-                f"{self.base_url}/files/{file_id}",
-                headers=headers,
-                params={"fields": "permissions,owners"},
-            )
-            perm_info = check.json()
+        # ❗ Kiểm tra permission thực sự
+        check = await client.get(
+            f"{self.base_url}/files/{file_id}",
+            headers=headers,
+            params={"fields": "permissions,owners"},
+        )
+        perm_info = check.json()
 
-            logger.info("📌 Kiểm tra permission sau khi cấp:")
-            logger.info(json.dumps(perm_info, indent=2))
+        logger.info("📌 Kiểm tra permission sau khi cấp:")
+        logger.info(json.dumps(perm_info, indent=2))
 
         return {
             "view_link": f"https://drive.google.com/uc?id={file_id}",
@@ -256,3 +342,8 @@ async def get_google_drive_service() -> GoogleDriveAsyncService:
         logger.info("🚀 Khởi tạo GoogleDriveAsyncService lần đầu.")
         _google_drive_service = await GoogleDriveAsyncService.create()
     return _google_drive_service
+
+
+async def close_google_drive_service():
+    if _google_drive_service is not None:
+        await _google_drive_service.aclose()
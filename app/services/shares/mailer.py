@@ -1,11 +1,30 @@
 # app/services/mailer.py
+import asyncio
 from pathlib import Path
+from typing import Any, Coroutine
 
 from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+from loguru import logger
 from pydantic import SecretStr
 
 from app.core.settings import settings
 
+# Giữ tham chiếu tới task gửi mail đang chạy (tránh bị GC giữa chừng)
+_mail_tasks: set[asyncio.Task] = set()
+
+
+def _on_mail_done(task: asyncio.Task) -> None:
+    _mail_tasks.discard(task)
+    if not task.cancelled() and task.exception():
+        logger.error(f"❌ Gửi email thất bại: {task.exception()}")
+
+
+def send_in_background(coro: Coroutine[Any, Any, Any]) -> None:
+    """Gửi email không chờ SMTP (response trả về ngay), lỗi chỉ được log lại."""
+    task = asyncio.create_task(coro)
+    _mail_tasks.add(task)
+    task.add_done_callback(_on_mail_done)
+
 
 class MailerService:
     """Service gửi email hệ thống (xác thực, reset mật khẩu, thông báo, v.v.)."""
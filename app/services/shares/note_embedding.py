@@ -0,0 +1,123 @@
+import asyncio
+import uuid
+from hashlib import blake2b
+
+from loguru import logger
+from sqlalchemy import select, update
+
+from app.core.embedding import get_embedding_service
+from app.db.models.database import LessonNotes
+from app.db.sesson import AsyncSessionLocal
+from app.libs.formats.datetime import now as get_now
+
+# Số worker nền và số note tối đa gom vào 1 lượt embedding
+NOTE_EMBED_WORKERS = 2
+NOTE_EMBED_BATCH = 16
+
+_note_queue: asyncio.Queue[uuid.UUID] | None = None
+_note_workers: list[asyncio.Task] = []
+
+
+def get_note_embedding_queue() -> asyncio.Queue[uuid.UUID]:
+    global _note_queue
+    if _note_queue is None:
+        _note_queue = asyncio.Queue()
+    return _note_queue
+
+
+def note_content_hash(content: str) -> str:
+    return blake2b(content.strip().encode("utf-8"), digest_size=16).hexdigest()
+
+
+def enqueue_note_embedding(note_id: uuid.UUID) -> None:
+    """Đẩy note vào hàng đợi embedding (không chờ, không mở session mới)."""
+    get_note_embedding_queue().put_nowait(note_id)
+
+
+async def _embed_notes(note_ids: list[uuid.UUID]) -> None:
+    """
+    1 session + 1 batch embed + 1 câu UPDATE (executemany) cho cả lô note.
+    Note có content_hash trùng với nội dung hiện tại và đã có embedding thì bỏ qua.
+    """
+    async with AsyncSessionLocal() as db:
+        try:
+            candidates = (
+                await db.execute(
+                    select(
+                        LessonNotes.id,
+                        LessonNotes.content,
+                        LessonNotes.content_hash,
+                        LessonNotes.embedding.is_not(None).label("has_embedding"),
+                    ).where(LessonNotes.id.in_(note_ids))
+                )
+            ).all()
+            rows, hashes = [], []
+            for r in candidates:
+                if not r.content or not r.content.strip():
+                    continue
+                h = note_content_hash(r.content)
+                if r.has_embedding and r.content_hash == h:
+                    continue
+                rows.append(r)
+                hashes.append(h)
+            if not rows:
+                return
+
+            embedding_service = await get_embedding_service()
+            vectors = await embedding_service.embed_google_normalized_batch(
+                [r.content for r in rows]
+            )
+
+            now = get_now()
+            # Vector 0 (embed lỗi) → không lưu hash để lần sau còn nhúng lại
+            await db.execute(
+                update(LessonNotes),
+                [
+                    {
+                        "id": r.id,
+                        "embedding": vec,
+                        "content_hash": h if any(vec) else None,
+                        "created_at": now,
+                    }
+                    for r, vec, h in zip(rows, vectors, hashes)
+                ],
+            )
+            await db.commit()
+            logger.info(f"✅ Đã nhúng embedding cho {len(rows)} note")
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"❌ Lỗi khi nhúng embedding note {note_ids}: {e}")
+
+
+async def _note_embedding_worker() -> None:
+    queue = get_note_embedding_queue()
+    while True:
+        note_ids = [await queue.get()]
+        # Gom thêm các note đang chờ sẵn (bursty write) vào cùng 1 lượt
+        while len(note_ids) < NOTE_EMBED_BATCH:
+            try:
+                note_ids.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        try:
+            await _embed_notes(note_ids)
+        except Exception:
+            # Lỗi (kể cả lúc rollback) không được làm chết worker → hàng đợi vẫn được xử lý tiếp
+            logger.exception(f"❌ Worker embedding note lỗi với lô {note_ids}")
+        finally:
+            for _ in note_ids:
+                queue.task_done()
+
+
+def start_note_embedding_workers() -> None:
+    if _note_workers:
+        return
+    for _ in range(NOTE_EMBED_WORKERS):
+        _note_workers.append(asyncio.create_task(_note_embedding_worker()))
+
+
+async def stop_note_embedding_workers() -> None:
+    for task in _note_workers:
+        task.cancel()
+    await asyncio.gather(*_note_workers, return_exceptions=True)
+    _note_workers.clear()
@@ -156,7 +156,7 @@ class NotificationService:
                 metadata_=schema.metadata or {},
                 action=schema.action or "open_url",
                 is_read=False,
-                created_at=await to_utc_naive(get_now()),
+                created_at=to_utc_naive(get_now()),
             )
 
             self.db.add(notif)
@@ -186,10 +186,10 @@ class NotificationService:
                     "action": notif.action,
                     "is_read": notif.is_read,
                     "read_at": (
-                        await to_utc_naive(notif.read_at) if notif.read_at else None
+                        to_utc_naive(notif.read_at) if notif.read_at else None
                     ),
-                    "created_at": await to_utc_naive(notif.created_at),
-                    "updated_at": await to_utc_naive(notif.updated_at),
+                    "created_at": to_utc_naive(notif.created_at),
+                    "updated_at": to_utc_naive(notif.updated_at),
                 },
             }
 
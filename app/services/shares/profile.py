@@ -1,7 +1,7 @@
 import uuid
 
 from fastapi import Depends, HTTPException, UploadFile
-from sqlalchemy import select
+from sqlalchemy import select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.models.database import User
@@ -66,10 +66,12 @@ class ProfileService:
             if not user:
                 raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
 
+            # Truyền thẳng file object (SpooledTemporaryFile) → Drive đọc stream theo chunk
+            await file.seek(0)
             file_url = await self.google_drive_service.upload_file(
                 ["avatars", str(user_id)],
                 file.filename or f"avatar_{user_id}_{uuid.uuid4()}.png",
-                await file.read(),
+                file.file,
                 file.content_type,
             )
             user.avatar = file_url.get("webViewLink", None)
@@ -85,28 +87,49 @@ class ProfileService:
     async def update_profile_by_user_id(
         self, user_id: uuid.UUID, profile_data: ProfileUpdate
     ):
-        user = await self.db.get(User, user_id)
-        if not user:
-            raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
-
-        # cập nhật tự động theo field được gửi (tránh viết thủ công từng cái)
-        for field, value in profile_data.model_dump(exclude_unset=True).items():
-            setattr(user, field, value)
+        columns = (
+            User.id,
+            User.fullname,
+            User.bio,
+            User.facebook_url,
+            User.birthday,
+            User.conscious,
+            User.district,
+            User.citizenship_identity,
+        )
+        dump = profile_data.model_dump(exclude_unset=True)
 
         try:
-            await self.db.commit()
-            await self.db.refresh(user)
+            if dump:
+                # 1 câu UPDATE ... RETURNING (không SELECT trước, không refresh sau)
+                row = (
+                    await self.db.execute(
+                        update(User)
+                        .where(User.id == user_id)
+                        .values(**dump)
+                        .returning(*columns)
+                        .execution_options(synchronize_session=False)
+                    )
+                ).first()
+                await self.db.commit()
+            else:
+                # Không có field nào thay đổi → chỉ đọc lại, bỏ qua UPDATE
+                row = (
+                    await self.db.execute(select(*columns).where(User.id == user_id))
+                ).first()
         except Exception as e:
             await self.db.rollback()
             raise HTTPException(status_code=500, detail=f"Lỗi khi cập nhật hồ sơ: {e}")
 
+        if not row:
+            raise HTTPException(status_code=404, detail="Không tìm thấy người dùng")
         return {
-            "id": str(user.id),
-            "fullname": user.fullname,
-            "bio": user.bio,
-            "facebook_url": user.facebook_url,
-            "birthday": user.birthday,
-            "conscious": user.conscious,
-            "district": user.district,
-            "citizenship_identity": user.citizenship_identity,
+            "id": str(row.id),
+            "fullname": row.fullname,
+            "bio": row.bio,
+            "facebook_url": row.facebook_url,
+            "birthday": row.birthday,
+            "conscious": row.conscious,
+            "district": row.district,
+            "citizenship_identity": row.citizenship_identity,
         }
@@ -871,8 +871,8 @@ class TransactionsService:
         - Có summary: total_amount, total_in, total_out (chỉ completed)
         """
         # Chuẩn hóa datetime về UTC+7 naive để tránh offset-aware vs offset-naive
-        date_from = await to_vietnam_naive(date_from)
-        date_to = await to_vietnam_naive(date_to)
+        date_from = to_vietnam_naive(date_from)
+        date_to = to_vietnam_naive(date_to)
         # Map field sort an toàn
         valid_sort_fields = {
             "amount": Transactions.amount,
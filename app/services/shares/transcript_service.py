@@ -1,18 +1,23 @@
 import asyncio
 
 from fastapi import HTTPException
+from loguru import logger
 from youtube_transcript_api import YouTubeTranscriptApi
 
 
 class YoutubeTranscriptService:
     """Service xử lý lấy phụ đề (transcript) từ video YouTube."""
 
+    def __init__(self):
+        # Dùng chung 1 client (giữ HTTP session) cho mọi lần fetch
+        self._api = YouTubeTranscriptApi()
+
     async def fetch_transcript(self, video_id: str, lang_priority=("vi", "en")):
         """Lấy phụ đề gốc từ YouTube."""
         try:
             # chạy trong thread để không block event loop
             transcript = await asyncio.to_thread(
-                lambda: YouTubeTranscriptApi().fetch(video_id, languages=lang_priority)
+                lambda: self._api.fetch(video_id, languages=lang_priority)
             )
             return transcript
         except Exception as e:
@@ -37,3 +42,17 @@ class YoutubeTranscriptService:
         if not markdown:
             raise HTTPException(404, detail="❌ Không tìm thấy phụ đề cho video này.")
         return markdown
+
+
+# ============================================================
+# ⚡ Singleton Provider
+# ============================================================
+_transcript_service: YoutubeTranscriptService | None = None
+
+
+def get_transcript_service() -> YoutubeTranscriptService:
+    global _transcript_service
+    if _transcript_service is None:
+        logger.info("🚀 Khởi tạo YoutubeTranscriptService lần đầu.")
+        _transcript_service = YoutubeTranscriptService()
+    return _transcript_service
@@ -60,8 +60,8 @@ class WalletsService:
                     user_id=user_id,
                     balance=0,
                     currency="VND",
-                    created_at=await to_utc_naive(get_now()),
-                    updated_at=await to_utc_naive(get_now()),
+                    created_at=to_utc_naive(get_now()),
+                    updated_at=to_utc_naive(get_now()),
                 )
                 self.db.add(wallet)
                 await self.db.commit()
@@ -128,7 +128,7 @@ class WalletsService:
                 return_pathname=schema.return_pathname,
                 return_origin=schema.return_origin,
                 description=f"Nạp {schema.amount_vnd:,} VNĐ qua PayPal (~{usd_value:.2f} USD)",
-                created_at=await to_utc_naive(get_now()),
+                created_at=to_utc_naive(get_now()),
             )
             self.db.add(transaction)
             await self.db.commit()
@@ -232,7 +232,7 @@ class WalletsService:
         # 5) TIỀN NẠP
         # ========================
         amount = transaction.amount or Decimal(0)
-        now = await to_utc_naive(get_now())
+        now = to_utc_naive(get_now())
 
         # Cập nhật ví user
         wallet.balance = (wallet.balance or 0) + amount
@@ -346,7 +346,7 @@ class WalletsService:
 
             # ❌ Đánh dấu giao dịch thất bại / bị hủy
             transaction.status = "canceled"
-            transaction.confirmed_at = await to_utc_naive(get_now())
+            transaction.confirmed_at = to_utc_naive(get_now())
             transaction.description = (
                 transaction.description or ""
             ) + " (Người dùng hủy trên PayPal)"
@@ -3,14 +3,13 @@ import uuid
 from datetime import datetime
 from typing import Any, Optional
 
-from fastapi import BackgroundTasks, Depends, HTTPException, status
+from fastapi import Depends, HTTPException, status
 from loguru import logger
 from sqlalchemy import asc, delete, desc, exists, func, insert, select, update
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
-from app.core.embedding import get_embedding_service
 from app.core.ws_manager import ws_manager
 from app.db.models.database import (
     CourseEnrollments,
@@ -39,7 +38,8 @@ from app.schemas.user.learning import (
     UpdateLessonComment,
     UpdateLessonNote,
 )
-from app.services.shares.code_runner import PistonService
+from app.services.shares.code_runner import PistonService, get_piston_service
+from app.services.shares.note_embedding import enqueue_note_embedding
 
 
 class LearningService:
@@ -48,7 +48,7 @@ class LearningService:
     def __init__(
         self,
         db: AsyncSession = Depends(get_session),
-        piston: PistonService = Depends(PistonService),
+        piston: PistonService = Depends(get_piston_service),
     ):
         self.db = db
         self.piston = piston
@@ -1360,7 +1360,7 @@ class LearningService:
                         content=content,
                         is_main=is_main,
                         is_pass=False,
-                        updated_at=await to_utc_naive(get_now()),
+                        updated_at=to_utc_naive(get_now()),
                     )
                 )
                 message = f"Đã cập nhật file '{filename}'"
@@ -1375,8 +1375,8 @@ class LearningService:
                         user_id=user.id,
                         is_main=is_main,
                         is_pass=False,
-                        created_at=await to_utc_naive(get_now()),
-                        updated_at=await to_utc_naive(get_now()),
+                        created_at=to_utc_naive(get_now()),
+                        updated_at=to_utc_naive(get_now()),
                     )
                 )
                 message = f"Đã tạo mới file '{filename}'"
@@ -1399,7 +1399,7 @@ class LearningService:
         - Lấy testcases từ DB → chạy từng cái
         - So sánh output, kiểm tra thời gian / bộ nhớ
         - Nếu pass toàn bộ → lưu file user + đánh dấu is_pass=True
-        - Dùng ORM + await to_utc_naive(get_now())
+        - Dùng ORM + to_utc_naive(get_now())
         """
 
         try:
@@ -1529,7 +1529,7 @@ class LearningService:
                         LessonCodeFiles.user_id == user.id,
                         LessonCodeFiles.role == "user",
                     )
-                    .values(is_pass=True, updated_at=await to_utc_naive(get_now()))
+                    .values(is_pass=True, updated_at=to_utc_naive(get_now()))
                 )
                 await self.db.commit()
 
@@ -1614,37 +1614,12 @@ class LearningService:
             logger.exception(f"🔥 Lỗi server khi lấy start code: {e}")
             raise HTTPException(500, f"Lỗi server khi lấy start code: {e}")
 
-    # 🧠 Chạy nền nhúng embedding
-    @staticmethod
-    async def _process_embedding_background(note_id: uuid.UUID):
-
-        async with AsyncSessionLocal() as db:
-            try:
-                note = await db.scalar(
-                    select(LessonNotes).where(LessonNotes.id == note_id)
-                )
-                if not note or not note.content.strip():
-                    return
-
-                embedding_service = await get_embedding_service()
-                vector = await embedding_service.embed_google_normalized(note.content)
-
-                note.embedding = vector
-                note.created_at = get_now()
-                await db.commit()
-
-                print(f"✅ Đã nhúng embedding cho note {note_id}")
-            except Exception as e:
-                await db.rollback()
-                print(f"❌ Lỗi khi nhúng embedding note {note_id}: {e}")
-
     # ✏️ Tạo ghi chú cho bài học
     async def create_lesson_note_async(
         self,
         lesson_id: uuid.UUID,
         schema: CreateLessonNote,
         user_id: uuid.UUID,
-        background_tasks: BackgroundTasks,
     ):
         try:
             # 1️⃣ Kiểm tra bài học tồn tại
@@ -1661,17 +1636,15 @@ class LearningService:
                 user_id=user_id,
                 time_seconds=schema.time_seconds,
                 content=schema.content.strip(),
-                created_at=await to_utc_naive(get_now()),
+                created_at=to_utc_naive(get_now()),
             )
 
             self.db.add(new_note)
             await self.db.commit()
             await self.db.refresh(new_note)
 
-            # 3️⃣ Gọi nền nhúng embedding (async)
-            background_tasks.add_task(
-                LearningService._process_embedding_background, new_note.id
-            )
+            # 3️⃣ Đẩy vào hàng đợi embedding nền (worker gom lô)
+            enqueue_note_embedding(new_note.id)
 
             return {
                 "message": "Tạo ghi chú thành công",
@@ -1760,6 +1733,7 @@ class LearningService:
                     404, "Không tìm thấy ghi chú hoặc bạn không có quyền sửa"
                 )
 
+            content_changed = note.content != schema.content.strip()
             note.content = schema.content.strip()
             if schema.time_seconds is not None:
                 note.time_seconds = float(schema.time_seconds)
@@ -1767,6 +1741,10 @@ class LearningService:
             await self.db.commit()
             await self.db.refresh(note)
 
+            # Nội dung đổi → nhúng lại nền (worker bỏ qua nếu content_hash không đổi)
+            if content_changed:
+                enqueue_note_embedding(note.id)
+
             return {
                 "message": "Cập nhật ghi chú thành công",
                 "note": {
@@ -2147,8 +2125,8 @@ class LearningService:
                     root_id=root_id,
                     content=schema.content.strip(),
                     depth=depth,
-                    created_at=await to_utc_naive(get_now()),
-                    updated_at=await to_utc_naive(get_now()),
+                    created_at=to_utc_naive(get_now()),
+                    updated_at=to_utc_naive(get_now()),
                 )
 
                 db.add(new_comment)
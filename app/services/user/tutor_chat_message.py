@@ -93,7 +93,7 @@ class TutorChatMessageService:
 
             # 2. OCR
             try:
-                ocr_text = self.ocr_service.extract_text_from_image(content)
+                ocr_text = await self.ocr_service.extract_text_from_image(content)
             except Exception:
                 ocr_text = ""
 
@@ -799,6 +799,7 @@ CREATE TABLE public.lesson_notes (
     content text NOT NULL,
     embedding public.vector(1536),
     created_at timestamp with time zone DEFAULT now(),
+    content_hash text,
     CONSTRAINT lesson_notes_time_seconds_check CHECK ((time_seconds >= 0))
 );
 
@@ -3643,6 +3644,14 @@ ALTER TABLE ONLY public.supported_languages
     ADD CONSTRAINT supported_languages_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: supported_languages uq_supported_lang_name_ver; Type: CONSTRAINT; Schema: public; Owner: admin
+--
+
+ALTER TABLE ONLY public.supported_languages
+    ADD CONSTRAINT uq_supported_lang_name_ver UNIQUE (name, version);
+
+
 --
 -- Name: topics topics_pkey; Type: CONSTRAINT; Schema: public; Owner: admin
 --
@@ -3744,6 +3753,13 @@ CREATE INDEX courses_embedding_idx ON public.courses USING hnsw (embedding publi
 CREATE INDEX idx_categories_parent_order ON public.categories USING btree (parent_id, order_index);
 
 
+--
+-- Name: idx_email_verifications_user_created; Type: INDEX; Schema: public; Owner: admin
+--
+
+CREATE INDEX idx_email_verifications_user_created ON public.email_verifications USING btree (user_id, created_at DESC);
+
+
 --
 -- Name: idx_lc_lesson_created; Type: INDEX; Schema: public; Owner: admin
 --
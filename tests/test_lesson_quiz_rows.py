@@ -0,0 +1,67 @@
+import uuid
+from datetime import datetime
+
+from app.schemas.lecturer.lesson import (
+    LessonQuizBulkCreate,
+    LessonQuizItemCreate,
+    LessonQuizOptionCreate,
+)
+from app.services.lecturer.lesson import LessonService
+
+
+def _quiz(quiz_id, option_ids):
+    return LessonQuizItemCreate(
+        id=quiz_id,
+        question="Q?",
+        options=[
+            LessonQuizOptionCreate(id=oid, text=f"opt {i}")
+            for i, oid in enumerate(option_ids)
+        ],
+    )
+
+
+def test_build_quiz_rows_gives_repeated_ids_fresh_uuids():
+    quiz_id = uuid.uuid4()
+    option_id = uuid.uuid4()
+    schema = LessonQuizBulkCreate(
+        lesson_id=uuid.uuid4(),
+        quizzes=[
+            _quiz(quiz_id, [option_id, option_id]),
+            _quiz(quiz_id, [option_id]),
+        ],
+    )
+
+    quiz_rows, option_rows = LessonService._build_quiz_rows(
+        schema,
+        None,
+        datetime(2026, 1, 1),
+        known_quiz_ids={quiz_id},
+        known_option_ids={option_id},
+    )
+
+    quiz_ids = [r["id"] for r in quiz_rows]
+    option_ids = [r["id"] for r in option_rows]
+    assert len(set(quiz_ids)) == len(quiz_ids) == 2
+    assert len(set(option_ids)) == len(option_ids) == 3
+    # Lần xuất hiện đầu tiên giữ id cũ, các lần lặp lại nhận id mới
+    assert quiz_ids[0] == quiz_id
+    assert option_ids[0] == option_id
+    assert [r["quiz_id"] for r in option_rows] == [
+        quiz_ids[0],
+        quiz_ids[0],
+        quiz_ids[1],
+    ]
+
+
+def test_build_quiz_rows_ignores_unknown_ids():
+    foreign_id = uuid.uuid4()
+    schema = LessonQuizBulkCreate(
+        lesson_id=uuid.uuid4(), quizzes=[_quiz(foreign_id, [foreign_id])]
+    )
+
+    quiz_rows, option_rows = LessonService._build_quiz_rows(
+        schema, None, datetime(2026, 1, 1)
+    )
+
+    assert quiz_rows[0]["id"] != foreign_id
+    assert option_rows[0]["id"] != foreign_id